@@ -1,6 +1,8 @@
 import os
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+import logging
+import orjson
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from models import Base
 
 DATABASE_URL = os.getenv("DATABASE_URL") or (
@@ -8,18 +10,41 @@ DATABASE_URL = os.getenv("DATABASE_URL") or (
     "@ep-sparkling-sunset-a1iowetz-pooler.ap-southeast-1.aws.neon.tech/neondb"
 )
 
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+# Prepared statements kept per connection; the sync path repeats a handful of upserts/selects
+DB_PREPARED_STATEMENT_CACHE_SIZE = os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "1024")
+DB_STATEMENT_TIMEOUT_MS = os.getenv("DB_STATEMENT_TIMEOUT_MS", "60000")
+SQL_ECHO = os.getenv("SQL_ECHO") == "1"
+
+# Keep SQLAlchemy's per-statement logging off unless SQL_ECHO=1 asks for it
+if not SQL_ECHO:
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
+
+_db_url = make_url(DATABASE_URL)
+if "prepared_statement_cache_size" not in _db_url.query:
+    _db_url = _db_url.update_query_dict({"prepared_statement_cache_size": DB_PREPARED_STATEMENT_CACHE_SIZE})
+
 engine = create_async_engine(
-    DATABASE_URL,
-    echo=False,              # Turn off SQL echo in production
+    _db_url,
+    echo=SQL_ECHO,           # SQL echo only when SQL_ECHO=1 (debugging)
+    pool_size=DB_POOL_SIZE,  # Persistent connections kept in the pool
+    max_overflow=DB_MAX_OVERFLOW,  # Extra connections allowed under burst load
     pool_pre_ping=True,      # Checks connections before using them
     pool_recycle=1800,       # Reconnect every 30 minutes
     pool_timeout=60,         # Wait 60s for a connection before raising
+    # JSONB columns (credentials, labels, attachments, events) are encoded/decoded by orjson's C code
+    json_serializer=lambda obj: orjson.dumps(obj).decode(),
+    json_deserializer=orjson.loads,
+    connect_args={
+        "server_settings": {"statement_timeout": DB_STATEMENT_TIMEOUT_MS},
+        "command_timeout": 60,  # asyncpg client-side query timeout (seconds)
+    },
 )
 
-async_session_maker = sessionmaker(
+async_session_maker = async_sessionmaker(
     bind=engine,
     expire_on_commit=False,
-    class_=AsyncSession,
 )
 
 async def get_async_session() -> AsyncSession:
@@ -1,34 +1,147 @@
 # discrepancy_utils.py
-from decimal import Decimal
-from typing import Dict, Any, Tuple, List
+import hashlib
+import math
+import orjson
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+
+from cachetools import LRUCache
+from typing import Dict, Any, Tuple, List, FrozenSet
 
 
 # --------------------------------------------------------------------
 # Helper utilities
 # --------------------------------------------------------------------
-def to_decimal(x) -> Decimal:
+def to_float(x) -> float:
+    # Numbers and empty values never touch the exception path; only
+    # non-empty strings (or other objects) need a guarded float().
+    if isinstance(x, (int, float)):
+        return float(x)
+    if not x:
+        return 0.0
     try:
-        return Decimal(str(x or 0))
-    except Exception:
-        return Decimal(0)
+        return float(x)
+    except (TypeError, ValueError):
+        return 0.0
 
 
-def approx_equal(a: Decimal, b: Decimal, tol: Decimal = Decimal("0.01")) -> bool:
+def approx_equal(a: float, b: float, tol: float = 0.01) -> bool:
     return abs(a - b) <= tol
 
 
-def compute_subtotal_from_lines(lines: List[Dict[str, Any]]) -> Decimal:
-    return sum(
-        to_decimal(li.get("quantity")) * to_decimal(li.get("unit_price"))
-        for li in lines
-        if li.get("quantity") is not None and li.get("unit_price") is not None
-    )
+def normalize_text(value):
+    """Trimmed, lower-cased form of a string; other values pass through."""
+    return value.strip().lower() if isinstance(value, str) else value
+
+
+@dataclass(slots=True)
+class LineItem:
+    """Line-item dict converted once per comparison; checks read attributes."""
+
+    quantity: float
+    unit_price: float
+    total: float
+    description: Any = None  # normalized; None when empty/missing
+    spec: Any = None
+    brand: Any = None
+    part_number: Any = None
+
+    @classmethod
+    def from_dict(cls, li: Dict[str, Any]) -> "LineItem":
+        desc = li.get("description")
+        return cls(
+            quantity=to_float(li.get("quantity")),
+            unit_price=to_float(li.get("unit_price")),
+            total=to_float(li.get("total")),
+            description=normalize_text(desc) if desc else None,
+            spec=li.get("spec"),
+            brand=li.get("brand"),
+            part_number=li.get("part_number"),
+        )
+
+
+def to_line_items(lines: List[Dict[str, Any]]) -> List[LineItem]:
+    return [LineItem.from_dict(li) for li in lines or []]
+
+
+def compute_subtotal_from_lines(lines: List[Dict[str, Any]]) -> float:
+    return compute_subtotal_from_items(to_line_items(lines))
+
+
+def compute_subtotal_from_items(items: List[LineItem]) -> float:
+    # Missing quantity or unit_price converts to 0.0, so those lines add nothing.
+    return sum(li.quantity * li.unit_price for li in items)
+
+
+# --------------------------------------------------------------------
+# Line-level numeric kernels (operate on to_line_items output)
+# --------------------------------------------------------------------
+def _price_line_flags(po_items: List[LineItem], inv_items: List[LineItem]) -> Tuple[int, int, int]:
+    """Return (variance, unauthorized_increase, tier_mismatch) over paired lines.
+
+    Single pass; stops once all three flags are set.
+    """
+    variance = increase = tier = 0
+    for po_li, inv_li in zip(po_items, inv_items):
+        po_up, inv_up = po_li.unit_price, inv_li.unit_price
+        if po_up and inv_up and not approx_equal(po_up, inv_up, tol=abs(po_up) * 0.01):
+            variance = 1
+            if inv_up > po_up:
+                increase = 1
+        # Price tier mismatch (≥20% difference)
+        if po_up > 0 and abs(inv_up - po_up) / po_up >= 0.20:
+            tier = 1
+        if variance and increase and tier:
+            break
+    return variance, increase, tier
+
+
+def _has_line_total_errors(items: List[LineItem]) -> bool:
+    return any(not approx_equal(li.quantity * li.unit_price, li.total) for li in items)
+
+
+# --------------------------------------------------------------------
+# Shared per-comparison aggregates
+# --------------------------------------------------------------------
+@dataclass(frozen=True)
+class _DocContext:
+    """Line-item values and totals computed once per PO/invoice pair."""
+
+    po_items: List[LineItem]
+    inv_items: List[LineItem]
+    po_qty_total: float
+    inv_qty_total: float
+    po_subtotal_from_lines: float
+    inv_subtotal_from_lines: float
+    po_descs: FrozenSet[Any]
+    po_total_f: float
+    inv_total_f: float
+
+    @classmethod
+    def build(cls, po: Dict[str, Any], inv: Dict[str, Any]) -> "_DocContext":
+        po_items = to_line_items(po.get("line_items"))
+        inv_items = to_line_items(inv.get("line_items"))
+        return cls(
+            po_items=po_items,
+            inv_items=inv_items,
+            po_qty_total=math.fsum(li.quantity for li in po_items),
+            inv_qty_total=math.fsum(li.quantity for li in inv_items),
+            po_subtotal_from_lines=compute_subtotal_from_items(po_items),
+            inv_subtotal_from_lines=compute_subtotal_from_items(inv_items),
+            po_descs=frozenset(li.description for li in po_items),
+            po_total_f=to_float(po.get("total_amount")),
+            inv_total_f=to_float(inv.get("total_amount")),
+        )
 
 
 # --------------------------------------------------------------------
 # Category 1: Quantity Discrepancies
 # --------------------------------------------------------------------
-def check_quantity_discrepancies(po: Dict[str, Any], inv: Dict[str, Any]) -> Tuple[Dict[str, int], int]:
+def check_quantity_discrepancies(
+    po: Dict[str, Any],
+    inv: Dict[str, Any],
+    ctx: _DocContext = None,
+) -> Tuple[Dict[str, int], int]:
     flags = {
         "Over-billing on quantity": 0,
         "Under-billing on quantity": 0,
@@ -36,13 +149,14 @@ def check_quantity_discrepancies(po: Dict[str, Any], inv: Dict[str, Any]) -> Tup
         "Partial shipments not reflected": 0,
     }
 
-    po_qty_total = sum(to_decimal(i.get("quantity")) for i in po.get("line_items", []))
-    inv_qty_total = sum(to_decimal(i.get("quantity")) for i in inv.get("line_items", []))
+    ctx = ctx or _DocContext.build(po, inv)
 
-    if inv_qty_total > po_qty_total:
-        flags["Over-billing on quantity"] = 1
-    elif inv_qty_total < po_qty_total:
-        flags["Under-billing on quantity"] = 1
+    # Float totals: fractional quantities (0.1 + 0.2) must not read as a mismatch
+    if not approx_equal(ctx.inv_qty_total, ctx.po_qty_total):
+        if ctx.inv_qty_total > ctx.po_qty_total:
+            flags["Over-billing on quantity"] = 1
+        else:
+            flags["Under-billing on quantity"] = 1
 
     # Partial shipment
     if po.get("requires_shipment") and not inv.get("delivery_date"):
@@ -55,7 +169,11 @@ def check_quantity_discrepancies(po: Dict[str, Any], inv: Dict[str, Any]) -> Tup
 # --------------------------------------------------------------------
 # Category 2: Price Discrepancies
 # --------------------------------------------------------------------
-def check_price_discrepancies(po: Dict[str, Any], inv: Dict[str, Any]) -> Tuple[Dict[str, int], int]:
+def check_price_discrepancies(
+    po: Dict[str, Any],
+    inv: Dict[str, Any],
+    ctx: _DocContext = None,
+) -> Tuple[Dict[str, int], int]:
     flags = {
         "Unit price variance": 0,
         "Missing discounts": 0,
@@ -64,40 +182,27 @@ def check_price_discrepancies(po: Dict[str, Any], inv: Dict[str, Any]) -> Tuple[
         "Unauthorized price increases": 0,
     }
 
-    po_lines = po.get("line_items", []) or []
-    inv_lines = inv.get("line_items", []) or []
+    ctx = ctx or _DocContext.build(po, inv)
 
-    # 1️⃣ Unit price variance / unauthorized price increase
-    for po_li, inv_li in zip(po_lines, inv_lines):
-        po_up = to_decimal(po_li.get("unit_price"))
-        inv_up = to_decimal(inv_li.get("unit_price"))
-        if po_up and inv_up and not approx_equal(po_up, inv_up, tol=abs(po_up) * Decimal("0.01")):
-            flags["Unit price variance"] = 1
-            if inv_up > po_up:
-                flags["Unauthorized price increases"] = 1
+    # 1️⃣ Unit price variance / unauthorized price increase / 3️⃣ tier mismatch
+    (
+        flags["Unit price variance"],
+        flags["Unauthorized price increases"],
+        flags["Price tier mismatches"],
+    ) = _price_line_flags(ctx.po_items, ctx.inv_items)
 
     # 2️⃣ Missing discounts: use model fields directly
-    po_discount = to_decimal(po.get("discount")) or to_decimal(po.get("discount_percent"))
-    inv_discount = to_decimal(inv.get("discount")) or to_decimal(inv.get("discount_percent"))
+    po_discount = to_float(po.get("discount")) or to_float(po.get("discount_percent"))
+    inv_discount = to_float(inv.get("discount")) or to_float(inv.get("discount_percent"))
     if po_discount > 0 and inv_discount == 0:
         flags["Missing discounts"] = 1
 
-    # 3️⃣ Price tier mismatch (≥20% difference)
-    for po_li, inv_li in zip(po_lines, inv_lines):
-        po_up = to_decimal(po_li.get("unit_price"))
-        inv_up = to_decimal(inv_li.get("unit_price"))
-        if po_up > 0:
-            diff = abs(inv_up - po_up) / po_up
-            if diff >= Decimal("0.20"):
-                flags["Price tier mismatches"] = 1
-                break
-
     # 4️⃣ Currency conversion errors (large ratio)
-    po_total = to_decimal(po.get("total_amount"))
-    inv_total = to_decimal(inv.get("total_amount"))
+    po_total = ctx.po_total_f
+    inv_total = ctx.inv_total_f
     if po_total and inv_total:
-        ratio = po_total / inv_total if inv_total != 0 else Decimal(0)
-        if ratio > Decimal("5") or ratio < Decimal("0.2"):
+        ratio = po_total / inv_total if inv_total != 0 else 0.0
+        if ratio > 5 or ratio < 0.2:
             flags["Currency conversion errors"] = 1
 
     return flags, sum(flags.values())
@@ -116,14 +221,14 @@ def check_tax_calculation_errors(po, inv):
         "Surcharge miscalculations": 0,
     }
 
-    po_tax = to_decimal(po.get("tax_amount"))
-    inv_tax = to_decimal(inv.get("tax_amount"))
-    subtotal = to_decimal(inv.get("subtotal"))
-    if subtotal and inv_tax and po_tax and not approx_equal(inv_tax, po_tax, tol=Decimal("0.5")):
+    po_tax = to_float(po.get("tax_amount"))
+    inv_tax = to_float(inv.get("tax_amount"))
+    subtotal = to_float(inv.get("subtotal"))
+    if subtotal and inv_tax and po_tax and not approx_equal(inv_tax, po_tax, tol=0.5):
         flags["Incorrect tax rates"] = 1
 
-    computed_total = subtotal + inv_tax - to_decimal(inv.get("discount"))
-    if not approx_equal(computed_total, to_decimal(inv.get("total_amount")), tol=Decimal("0.5")):
+    computed_total = subtotal + inv_tax - to_float(inv.get("discount"))
+    if not approx_equal(computed_total, to_float(inv.get("total_amount")), tol=0.5):
         flags["Calculation errors"] = 1
 
     if inv.get("tax_id") in (None, "", "NA"):
@@ -136,8 +241,8 @@ def check_tax_calculation_errors(po, inv):
             break
 
     # Surcharge miscalculations
-    expected_surcharge = to_decimal(inv.get("freight")) + to_decimal(inv.get("handling"))
-    if to_decimal(inv.get("surcharge")) and not approx_equal(expected_surcharge, to_decimal(inv.get("surcharge")), tol=Decimal("1.0")):
+    expected_surcharge = to_float(inv.get("freight")) + to_float(inv.get("handling"))
+    if to_float(inv.get("surcharge")) and not approx_equal(expected_surcharge, to_float(inv.get("surcharge")), tol=1.0):
         flags["Surcharge miscalculations"] = 1
 
     return flags, sum(flags.values())
@@ -146,7 +251,38 @@ def check_tax_calculation_errors(po, inv):
 # --------------------------------------------------------------------
 # Category 4: Duplicate Invoices
 # --------------------------------------------------------------------
-def check_duplicate_invoices(inv, other_invoices: List[Dict[str, Any]]):
+NEAR_DUPLICATE_TOL = 1.0
+
+
+@dataclass(frozen=True)
+class InvoiceIndex:
+    """Lookup structure over previously seen invoices for duplicate checks.
+
+    by_vendor maps vendor_name -> (totals sorted ascending, invoice_ids aligned with totals).
+    """
+
+    ids: FrozenSet[Any]
+    by_vendor: Dict[Any, Tuple[List[float], List[Any]]]
+
+
+def build_invoice_index(other_invoices: List[Dict[str, Any]]) -> InvoiceIndex:
+    """Build once per batch and reuse across check_duplicate_invoices calls."""
+    grouped: Dict[Any, List[Tuple[float, Any]]] = {}
+    for other in other_invoices or []:
+        grouped.setdefault(other.get("vendor_name"), []).append(
+            (to_float(other.get("total_amount")), other.get("invoice_id"))
+        )
+    by_vendor = {}
+    for vendor, entries in grouped.items():
+        entries.sort(key=lambda e: e[0])
+        by_vendor[vendor] = ([t for t, _ in entries], [i for _, i in entries])
+    return InvoiceIndex(
+        ids=frozenset(o.get("invoice_id") for o in other_invoices or []),
+        by_vendor=by_vendor,
+    )
+
+
+def check_duplicate_invoices(inv, other_invoices: List[Dict[str, Any]], index: InvoiceIndex = None):
     flags = {
         "Exact duplicates": 0,
         "Near-duplicates": 0,
@@ -154,17 +290,21 @@ def check_duplicate_invoices(inv, other_invoices: List[Dict[str, Any]]):
         "System-generated duplicates": 0,
     }
 
+    index = index or build_invoice_index(other_invoices)
     inv_id = inv.get("invoice_id")
-    inv_total = to_decimal(inv.get("total_amount"))
+    inv_total = to_float(inv.get("total_amount"))
 
-    for other in other_invoices or []:
-        if other.get("invoice_id") == inv_id:
-            flags["Exact duplicates"] = 1
-        elif (
-            other.get("vendor_name") == inv.get("vendor_name")
-            and abs(to_decimal(other.get("total_amount")) - inv_total) <= Decimal("1.0")
-        ):
+    if inv_id in index.ids:
+        flags["Exact duplicates"] = 1
+
+    # Same vendor with a total within ±1.0 (invoices sharing the id count as exact, not near)
+    totals, ids = index.by_vendor.get(inv.get("vendor_name"), ((), ()))
+    lo = bisect_left(totals, inv_total - NEAR_DUPLICATE_TOL - 1e-9)
+    hi = bisect_right(totals, inv_total + NEAR_DUPLICATE_TOL + 1e-9)
+    for pos in range(lo, hi):
+        if ids[pos] != inv_id and abs(totals[pos] - inv_total) <= NEAR_DUPLICATE_TOL:
             flags["Near-duplicates"] = 1
+            break
 
     return flags, sum(flags.values())
 
@@ -204,33 +344,30 @@ def check_missing_incomplete_data(inv):
 # --------------------------------------------------------------------
 # Category 6: Unauthorized Charges
 # --------------------------------------------------------------------
+CHARGE_FIELD_FLAGS = {
+    "freight": "Freight charges not in PO",
+    "handling": "Handling charges",
+    "cold_chain_surcharge": "Cold chain surcharges",
+    "expedited_fee": "Expedited delivery fees",
+    "tariff": "Tariffs/customs",
+    "customs": "Tariffs/customs",
+    "service_charge": "Service charges",
+}
+
+
 def check_unauthorized_charges(po, inv):
-    flags = {
-        "Freight charges not in PO": 0,
-        "Handling charges": 0,
-        "Cold chain surcharges": 0,
-        "Expedited delivery fees": 0,
-        "Tariffs/customs": 0,
-        "Service charges": 0,
-    }
+    flags = dict.fromkeys(CHARGE_FIELD_FLAGS.values(), 0)
 
-    charge_fields = ["freight", "handling", "cold_chain_surcharge", "expedited_fee", "tariff", "customs", "service_charge"]
-    for field in charge_fields:
-        po_val, inv_val = to_decimal(po.get(field)), to_decimal(inv.get(field))
-        if inv_val > 0 and po_val == 0:
-            flag_name = field.replace("_", " ").title()
-            # match field to specific flag
-            for k in flags.keys():
-                if field.split("_")[0] in k.lower():
-                    flags[k] = 1
-                    break
+    for field, flag in CHARGE_FIELD_FLAGS.items():
+        if to_float(inv.get(field)) > 0 and to_float(po.get(field)) == 0:
+            flags[flag] = 1
     return flags, sum(flags.values())
 
 
 # --------------------------------------------------------------------
 # Category 7: Line Item Description Mismatches
 # --------------------------------------------------------------------
-def check_line_item_description_mismatches(po, inv):
+def check_line_item_description_mismatches(po, inv, ctx: _DocContext = None):
     flags = {
         "Description text mismatches": 0,
         "Specification mismatches": 0,
@@ -238,14 +375,16 @@ def check_line_item_description_mismatches(po, inv):
         "Wrong product": 0,
     }
 
-    for po_li, inv_li in zip(po.get("line_items", []), inv.get("line_items", [])):
-        if po_li.get("description") and inv_li.get("description") and po_li["description"].strip().lower() != inv_li["description"].strip().lower():
+    ctx = ctx or _DocContext.build(po, inv)
+
+    for po_li, inv_li in zip(ctx.po_items, ctx.inv_items):
+        if po_li.description is not None and inv_li.description is not None and po_li.description != inv_li.description:
             flags["Description text mismatches"] = 1
-        if po_li.get("spec") and inv_li.get("spec") and po_li["spec"] != inv_li["spec"]:
+        if po_li.spec and inv_li.spec and po_li.spec != inv_li.spec:
             flags["Specification mismatches"] = 1
-        if po_li.get("brand") and inv_li.get("brand") and po_li["brand"] != inv_li["brand"]:
+        if po_li.brand and inv_li.brand and po_li.brand != inv_li.brand:
             flags["Brand differences"] = 1
-        if po_li.get("part_number") and inv_li.get("part_number") and po_li["part_number"] != inv_li["part_number"]:
+        if po_li.part_number and inv_li.part_number and po_li.part_number != inv_li.part_number:
             flags["Wrong product"] = 1
 
     return flags, sum(flags.values())
@@ -284,7 +423,7 @@ def check_documentation_reference_errors(po, inv):
 # --------------------------------------------------------------------
 # Category 9: Data Entry & Formatting Errors
 # --------------------------------------------------------------------
-def check_data_entry_formatting_errors(inv):
+def check_data_entry_formatting_errors(inv, ctx: _DocContext = None):
     flags = {
         "Transposition errors": 0,
         "Decimal point errors": 0,
@@ -294,10 +433,9 @@ def check_data_entry_formatting_errors(inv):
     }
 
     # Example heuristic: decimal errors if any line total != qty*unit_price
-    for li in inv.get("line_items", []):
-        qty, up, total = to_decimal(li.get("quantity")), to_decimal(li.get("unit_price")), to_decimal(li.get("total"))
-        if qty * up != total:
-            flags["Decimal point errors"] = 1
+    inv_items = ctx.inv_items if ctx else to_line_items(inv.get("line_items"))
+    if _has_line_total_errors(inv_items):
+        flags["Decimal point errors"] = 1
 
     return flags, sum(flags.values())
 
@@ -324,7 +462,7 @@ def check_timing_issues(inv):
 # --------------------------------------------------------------------
 # Category 11: Calculation Errors
 # --------------------------------------------------------------------
-def check_calculation_errors(inv):
+def check_calculation_errors(inv, ctx: _DocContext = None):
     flags = {
         "Line total calculation errors": 0,
         "Subtotal mismatches": 0,
@@ -333,12 +471,16 @@ def check_calculation_errors(inv):
         "Rounding error accumulation": 0,
     }
 
-    subtotal_from_lines = compute_subtotal_from_lines(inv.get("line_items", []))
-    if not approx_equal(subtotal_from_lines, to_decimal(inv.get("subtotal")), tol=Decimal("1.0")):
+    if ctx:
+        subtotal_from_lines = ctx.inv_subtotal_from_lines
+    else:
+        subtotal_from_lines = compute_subtotal_from_lines(inv.get("line_items"))
+    if not approx_equal(subtotal_from_lines, to_float(inv.get("subtotal")), tol=1.0):
         flags["Subtotal mismatches"] = 1
 
-    calc_total = to_decimal(inv.get("subtotal")) + to_decimal(inv.get("tax_amount")) - to_decimal(inv.get("discount"))
-    if not approx_equal(calc_total, to_decimal(inv.get("total_amount")), tol=Decimal("1.0")):
+    calc_total = to_float(inv.get("subtotal")) + to_float(inv.get("tax_amount")) - to_float(inv.get("discount"))
+    inv_total = ctx.inv_total_f if ctx else to_float(inv.get("total_amount"))
+    if not approx_equal(calc_total, inv_total, tol=1.0):
         flags["Invoice total errors"] = 1
 
     return flags, sum(flags.values())
@@ -347,19 +489,21 @@ def check_calculation_errors(inv):
 # --------------------------------------------------------------------
 # Category 12: Authorization & Approval Errors
 # --------------------------------------------------------------------
-def check_authorization_approval_errors(po, inv):
+def check_authorization_approval_errors(po, inv, ctx: _DocContext = None):
     flags = {
         "Line items not in PO": 0,
         "Missing change orders": 0,
         "Services not delivered": 0,
     }
 
-    po_descs = {li.get("description") for li in po.get("line_items", [])}
-    for inv_li in inv.get("line_items", []):
-        if inv_li.get("description") not in po_descs:
+    ctx = ctx or _DocContext.build(po, inv)
+
+    for inv_li in ctx.inv_items:
+        if inv_li.description not in ctx.po_descs:
             flags["Line items not in PO"] = 1
+            break
 
-    if to_decimal(inv.get("total_amount")) > to_decimal(po.get("total_amount")) * Decimal("1.05"):
+    if ctx.inv_total_f > ctx.po_total_f * 1.05:
         flags["Missing change orders"] = 1
 
     if not inv.get("delivery_date") and inv.get("requires_shipment"):
@@ -371,20 +515,61 @@ def check_authorization_approval_errors(po, inv):
 # --------------------------------------------------------------------
 # Main aggregator
 # --------------------------------------------------------------------
-def calculate_discrepancy(po_data: Dict[str, Any], inv_data: Dict[str, Any], other_invoices: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+# Documents carry no version/updated_at column, so results are keyed on a
+# digest of the full inputs: an edited PO or invoice simply misses the cache.
+_RESULT_CACHE: LRUCache = LRUCache(maxsize=2048)
+
+
+def _result_cache_key(po_data, inv_data, other_invoices) -> str:
+    payload = orjson.dumps(
+        [po_data, inv_data, other_invoices or []], option=orjson.OPT_SORT_KEYS, default=str
+    )
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def _copy_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "total_discrepancies": result["total_discrepancies"],
+        "detailed_flags": dict(result["detailed_flags"]),
+    }
+
+
+def calculate_discrepancy(
+    po_data: Dict[str, Any],
+    inv_data: Dict[str, Any],
+    other_invoices: List[Dict[str, Any]] = None,
+    invoice_index: InvoiceIndex = None,
+) -> Dict[str, Any]:
+    # A caller-supplied index may not match other_invoices, so only the
+    # plain (po, inv, others) form is memoized.
+    if invoice_index is not None:
+        return _calculate_discrepancy(po_data, inv_data, other_invoices, invoice_index)
+
+    key = _result_cache_key(po_data, inv_data, other_invoices)
+    result = _RESULT_CACHE.get(key)
+    if result is None:
+        result = _calculate_discrepancy(po_data, inv_data, other_invoices, None)
+        _RESULT_CACHE[key] = result
+    return _copy_result(result)
+
+
+def _calculate_discrepancy(po_data, inv_data, other_invoices, invoice_index) -> Dict[str, Any]:
+    # Scan line items once and share the aggregates across the checks
+    ctx = _DocContext.build(po_data, inv_data)
+
     categories = {
-        "Quantity Discrepancies": check_quantity_discrepancies(po_data, inv_data),
-        "Price Discrepancies": check_price_discrepancies(po_data, inv_data),
+        "Quantity Discrepancies": check_quantity_discrepancies(po_data, inv_data, ctx),
+        "Price Discrepancies": check_price_discrepancies(po_data, inv_data, ctx),
         "Tax and Calculation Errors": check_tax_calculation_errors(po_data, inv_data),
-        "Duplicate Invoices": check_duplicate_invoices(inv_data, other_invoices or []),
+        "Duplicate Invoices": check_duplicate_invoices(inv_data, other_invoices or [], invoice_index),
         "Missing / Incomplete Data": check_missing_incomplete_data(inv_data),
         "Unauthorized Charges": check_unauthorized_charges(po_data, inv_data),
-        "Line Item Description Mismatches": check_line_item_description_mismatches(po_data, inv_data),
+        "Line Item Description Mismatches": check_line_item_description_mismatches(po_data, inv_data, ctx),
         "Documentation & Reference Errors": check_documentation_reference_errors(po_data, inv_data),
-        "Data Entry & Formatting Errors": check_data_entry_formatting_errors(inv_data),
+        "Data Entry & Formatting Errors": check_data_entry_formatting_errors(inv_data, ctx),
         "Timing Issues": check_timing_issues(inv_data),
-        "Calculation Errors": check_calculation_errors(inv_data),
-        "Authorization & Approval Errors": check_authorization_approval_errors(po_data, inv_data),
+        "Calculation Errors": check_calculation_errors(inv_data, ctx),
+        "Authorization & Approval Errors": check_authorization_approval_errors(po_data, inv_data, ctx),
     }
 
     detailed_flags = {}
@@ -398,7 +583,32 @@ def calculate_discrepancy(po_data: Dict[str, Any], inv_data: Dict[str, Any], oth
         "detailed_flags": detailed_flags,
     }
 
+
+def calculate_discrepancies_batch(
+    pairs: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+    other_invoices: List[Dict[str, Any]] = None,
+) -> Tuple[List[str], List[List[int]], List[int]]:
+    """Run every check over many PO/invoice pairs against one shared invoice index.
+
+    Returns (flag_names, matrix, totals): matrix[i][j] is flag_names[j] for
+    pairs[i] and totals[i] is that pair's total_discrepancies.
+    """
+    index = build_invoice_index(other_invoices or [])
+    flag_names: List[str] = []
+    matrix: List[List[int]] = []
+    totals: List[int] = []
+    for po_data, inv_data in pairs:
+        result = _calculate_discrepancy(po_data, inv_data, other_invoices, index)
+        flags = result["detailed_flags"]
+        if not flag_names:
+            flag_names = list(flags)
+        matrix.append(list(flags.values()))
+        totals.append(result["total_discrepancies"])
+    return flag_names, matrix, totals
+
+
 # Example usage
-example_po = {"vendor_name":"Acme","vendor_id":None,"po_number":"10292","invoice_id":"5873","total_amount":13113.28,"subtotal":12647.5,"tax_amount":1250.78,"discount":1100.0,"discount_percent":8.77,"surcharge":0.0,"freight":360.0,"handling":75.0,"cold_chain_surcharge":0.0,"expedited_fee":0.0,"tariff":0.0,"customs":0.0,"service_charge":0.0,"invoice_date":"05/01/2024","po_date":"04/26/2024","delivery_date":"04/30/2024","service_from":"01/01/2024","service_to":"03/31/2024","tax_id":"985652","bank_account":"4605","payment_method":"ACH","payment_terms":"Finance","vendor_approved":True,"grn":"625849","delivery_note":"2914","tracking_number":"AB45638589CA","bill_to":"ABC Cerporation","cost_center":None,"requires_shipment":True,"notes":None,"line_items":[{"description":"Product 1","quantity":30,"total":7500,"unit_price":250},{"description":"Product 2","quantity":5,"total":247.5,"unit_price":49.5},{"description":"Service 1","quantity":1,"total":4800,"unit_price":4800}],"created_by":None}
-example_invoice = {"vendor_name":"Acme","vendor_id":None,"po_number":"10292","invoice_id":"5873","total_amount":13113.28,"subtotal":12647.5,"tax_amount":1250.78,"discount":1100.0,"discount_percent":8.77,"surcharge":0.0,"freight":360.0,"handling":75.0,"cold_chain_surcharge":0.0,"expedited_fee":0.0,"tariff":0.0,"customs":0.0,"service_charge":0.0,"invoice_date":"05/01/2024","po_date":"04/26/2024","delivery_date":"04/30/2024","service_from":"01/01/2024","service_to":"03/31/2024","tax_id":"985652","bank_account":"4605","payment_method":"ACH","payment_terms":"Finance","vendor_approved":True,"grn":"625849","delivery_note":"2914","tracking_number":"AB45638589CA","bill_to":"ABC Cerporation","cost_center":None,"requires_shipment":True,"notes":None,"line_items":[{"description":"Product 1","quantity":30,"total":7500,"unit_price":250},{"description":"Product 2","quantity":5,"total":247.5,"unit_price":49.5},{"description":"Service 1","quantity":1,"total":4800,"unit_price":4800}],"created_by":None}
-print(calculate_discrepancy(example_po, example_invoice))
\ No newline at end of file
+if __name__ == "__main__":
+    example_po = {"vendor_name":"Acme","vendor_id":None,"po_number":"10292","invoice_id":"5873","total_amount":13113.28,"subtotal":12647.5,"tax_amount":1250.78,"discount":1100.0,"discount_percent":8.77,"surcharge":0.0,"freight":360.0,"handling":75.0,"cold_chain_surcharge":0.0,"expedited_fee":0.0,"tariff":0.0,"customs":0.0,"service_charge":0.0,"invoice_date":"05/01/2024","po_date":"04/26/2024","delivery_date":"04/30/2024","service_from":"01/01/2024","service_to":"03/31/2024","tax_id":"985652","bank_account":"4605","payment_method":"ACH","payment_terms":"Finance","vendor_approved":True,"grn":"625849","delivery_note":"2914","tracking_number":"AB45638589CA","bill_to":"ABC Cerporation","cost_center":None,"requires_shipment":True,"notes":None,"line_items":[{"description":"Product 1","quantity":30,"total":7500,"unit_price":250},{"description":"Product 2","quantity":5,"total":247.5,"unit_price":49.5},{"description":"Service 1","quantity":1,"total":4800,"unit_price":4800}],"created_by":None}
+    example_invoice = {"vendor_name":"Acme","vendor_id":None,"po_number":"10292","invoice_id":"5873","total_amount":13113.28,"subtotal":12647.5,"tax_amount":1250.78,"discount":1100.0,"discount_percent":8.77,"surcharge":0.0,"freight":360.0,"handling":75.0,"cold_chain_surcharge":0.0,"expedited_fee":0.0,"tariff":0.0,"customs":0.0,"service_charge":0.0,"invoice_date":"05/01/2024","po_date":"04/26/2024","delivery_date":"04/30/2024","service_from":"01/01/2024","service_to":"03/31/2024","tax_id":"985652","bank_account":"4605","payment_method":"ACH","payment_terms":"Finance","vendor_approved":True,"grn":"625849","delivery_note":"2914","tracking_number":"AB45638589CA","bill_to":"ABC Cerporation","cost_center":None,"requires_shipment":True,"notes":None,"line_items":[{"description":"Product 1","quantity":30,"total":7500,"unit_price":250},{"description":"Product 2","quantity":5,"total":247.5,"unit_price":49.5},{"description":"Service 1","quantity":1,"total":4800,"unit_price":4800}],"created_by":None}
+    print(calculate_discrepancy(example_po, example_invoice))
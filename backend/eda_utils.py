@@ -1,24 +1,96 @@
-import statistics
-from datetime import datetime
+import re
+from calendar import monthrange
+from datetime import date
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func, union_all, case, text
 from models import PurchaseOrderDB, InvoiceDB, CompareResponseDB
-from typing import Dict, Any, List
+from typing import Dict, Any
 
 
 # ---------------------- HELPER ----------------------
-def safe_mean(values: List[float]) -> float:
-    """Return mean safely even if list is empty."""
-    return round(statistics.mean(values), 2) if values else 0.0
-
-
 def to_float(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not value:
+        return 0.0
     try:
-        return float(value) if value is not None else 0.0
-    except:
+        return float(value)
+    except (TypeError, ValueError):
         return 0.0
 
 
+# Accepted layouts, in the order they used to be tried with strptime:
+# %Y-%m-%d, %d/%m/%Y, %Y/%m/%d (strptime's %d also takes a space-padded
+# single digit). Each pattern yields (year, month, day).
+DATE_PATTERNS = (
+    (re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2}| \d)"), (1, 2, 3)),
+    (re.compile(r"(\d{1,2}| \d)/(\d{1,2})/(\d{4})"), (3, 2, 1)),
+    (re.compile(r"(\d{4})/(\d{1,2})/(\d{1,2}| \d)"), (1, 2, 3)),
+)
+
+
+def parse_date(date_str):
+    """Parse a stored date string without raising; None if it is not a valid date."""
+    if not date_str:
+        return None
+    for pattern, (yi, mi, di) in DATE_PATTERNS:
+        match = pattern.fullmatch(date_str)
+        if match:
+            year, month, day = int(match[yi]), int(match[mi]), int(match[di])
+            if year >= 1 and 1 <= month <= 12 and 1 <= day <= monthrange(year, month)[1]:
+                return date(year, month, day)
+            return None
+    return None
+
+
+def ratio_mean(total: float, count: int) -> float:
+    """Mean from a pre-aggregated sum and count."""
+    return round(total / count, 2) if count else 0.0
+
+
+def doc_totals_query(model, user_id: int):
+    """Per-table counts and sums; NULL amounts count as 0 like to_float()."""
+    return select(
+        func.count().label("n"),
+        func.coalesce(func.sum(model.total_amount), 0.0).label("total_sum"),
+        func.coalesce(func.sum(model.subtotal), 0.0).label("subtotal_sum"),
+        func.coalesce(func.sum(model.tax_amount), 0.0).label("tax_sum"),
+        func.coalesce(func.sum(model.discount), 0.0).label("discount_sum"),
+        func.count(func.nullif(model.discount, 0)).label("discount_n"),
+        func.count(func.nullif(model.po_number, "")).label("po_links"),
+    ).where(model.created_by == user_id)
+
+
+# Rows fetched per round trip when streaming per-document results
+STREAM_BATCH_SIZE = 500
+
+
+LINE_ITEM_SQL = text("""
+    SELECT name, SUM(qty) AS qty, SUM(qty * price) AS total_value,
+           COUNT(*) OVER () AS unique_items
+    FROM (
+        SELECT COALESCE(NULLIF(elem->>'item', ''), elem->>'description') AS name,
+               CASE WHEN jsonb_typeof(elem->'qty') = 'number'
+                    THEN (elem->>'qty')::float ELSE 0 END AS qty,
+               CASE WHEN jsonb_typeof(elem->'price') = 'number'
+                    THEN (elem->>'price')::float ELSE 0 END AS price
+        FROM (
+            SELECT line_items FROM purchase_orders WHERE created_by = :user_id
+            UNION ALL
+            SELECT line_items FROM invoices WHERE created_by = :user_id
+        ) docs,
+        jsonb_array_elements(
+            CASE WHEN jsonb_typeof(docs.line_items) = 'array'
+                 THEN docs.line_items ELSE '[]'::jsonb END
+        ) AS elem
+    ) items
+    WHERE name IS NOT NULL AND name <> ''
+    GROUP BY name
+    ORDER BY total_value DESC
+    LIMIT 10
+""")
+
+
 # ---------------------- MAIN FUNCTION ----------------------
 async def get_user_eda(session: AsyncSession, user_id: int) -> Dict[str, Any]:
     """
@@ -31,34 +103,47 @@ async def get_user_eda(session: AsyncSession, user_id: int) -> Dict[str, Any]:
       5. Discrepancy Insights
       6. Line Item-Level Insights
       7. Temporal Trends
-    """
 
-    # ---------------------- LOAD DATA ----------------------
-    po_query = await session.execute(
-        select(PurchaseOrderDB).where(PurchaseOrderDB.created_by == user_id)
-    )
-    inv_query = await session.execute(
-        select(InvoiceDB).where(InvoiceDB.created_by == user_id)
-    )
-    comp_query = await session.execute(
-        select(CompareResponseDB).where(CompareResponseDB.created_by == user_id)
-    )
+    Sums, counts and groupings run in Postgres; only the aggregated rows
+    (plus the date/amount columns needed for monthly trends) are fetched.
+    """
 
-    pos = po_query.scalars().all()
-    invoices = inv_query.scalars().all()
-    comparisons = comp_query.scalars().all()
+    # ---------------------- LOAD AGGREGATES ----------------------
+    po_agg = (await session.execute(doc_totals_query(PurchaseOrderDB, user_id))).one()
+    inv_agg = (await session.execute(doc_totals_query(InvoiceDB, user_id))).one()
 
-    # Flatten totals for numeric analysis
-    all_docs = pos + invoices
+    user_docs = union_all(
+        select(
+            PurchaseOrderDB.vendor_name,
+            PurchaseOrderDB.total_amount,
+            PurchaseOrderDB.invoice_date,
+            PurchaseOrderDB.po_date,
+        ).where(PurchaseOrderDB.created_by == user_id),
+        select(
+            InvoiceDB.vendor_name,
+            InvoiceDB.total_amount,
+            InvoiceDB.invoice_date,
+            InvoiceDB.po_date,
+        ).where(InvoiceDB.created_by == user_id),
+    ).subquery()
+    named_vendor = func.nullif(user_docs.c.vendor_name, "").isnot(None)
 
     # ---------------------- 1. DOCUMENT SUMMARY ----------------------
-    total_pos = len(pos)
-    total_invoices = len(invoices)
+    total_pos = po_agg.n
+    total_invoices = inv_agg.n
     total_docs = total_pos + total_invoices
-    total_value = sum(to_float(d.total_amount) for d in all_docs)
-    avg_invoice_value = safe_mean([to_float(i.total_amount) for i in invoices])
-    unique_vendors = len(set(d.vendor_name for d in all_docs if d.vendor_name))
-    invoice_po_links = sum(1 for i in invoices if i.po_number)
+    total_value = po_agg.total_sum + inv_agg.total_sum
+    avg_invoice_value = ratio_mean(inv_agg.total_sum, total_invoices)
+
+    vendor_totals = (
+        await session.execute(
+            select(
+                func.count(user_docs.c.vendor_name.distinct()),
+                func.count(),
+            ).where(named_vendor)
+        )
+    ).one()
+    unique_vendors, vendor_doc_count = vendor_totals
 
     document_summary = {
         "total_purchase_orders": total_pos,
@@ -66,7 +151,7 @@ async def get_user_eda(session: AsyncSession, user_id: int) -> Dict[str, Any]:
         "total_documents": total_docs,
         "total_value": total_value,
         "average_invoice_value": avg_invoice_value,
-        "linked_invoice_to_po_ratio": round(invoice_po_links / total_invoices, 2)
+        "linked_invoice_to_po_ratio": round(inv_agg.po_links / total_invoices, 2)
         if total_invoices else 0,
         "unique_vendors": unique_vendors,
     }
@@ -83,58 +168,65 @@ async def get_user_eda(session: AsyncSession, user_id: int) -> Dict[str, Any]:
     }
 
     # ---------------------- 2. FINANCIAL INSIGHTS ----------------------
-    subtotals = [to_float(d.subtotal) for d in all_docs]
-    taxes = [to_float(d.tax_amount) for d in all_docs]
-    discounts = [to_float(d.discount) for d in all_docs if d.discount]
-    totals = [to_float(d.total_amount) for d in all_docs]
+    subtotal_sum = po_agg.subtotal_sum + inv_agg.subtotal_sum
+    tax_sum = po_agg.tax_sum + inv_agg.tax_sum
+    discount_sum = po_agg.discount_sum + inv_agg.discount_sum
+    discount_n = po_agg.discount_n + inv_agg.discount_n
 
     financial_summary = {
-        "avg_subtotal": safe_mean(subtotals),
-        "avg_tax_amount": safe_mean(taxes),
-        "avg_discount": safe_mean(discounts),
-        "avg_total_amount": safe_mean(totals),
-        "total_tax_paid": sum(taxes),
-        "total_discount": sum(discounts),
+        "avg_subtotal": ratio_mean(subtotal_sum, total_docs),
+        "avg_tax_amount": ratio_mean(tax_sum, total_docs),
+        "avg_discount": ratio_mean(discount_sum, discount_n),
+        "avg_total_amount": ratio_mean(total_value, total_docs),
+        "total_tax_paid": tax_sum,
+        "total_discount": discount_sum,
         "effective_tax_rate": round(
-            (sum(taxes) / sum(subtotals) * 100) if sum(subtotals) else 0, 2
+            (tax_sum / subtotal_sum * 100) if subtotal_sum else 0, 2
         ),
         "effective_discount_rate": round(
-            (sum(discounts) / sum(subtotals) * 100) if sum(subtotals) else 0, 2
+            (discount_sum / subtotal_sum * 100) if subtotal_sum else 0, 2
         ),
     }
 
+    inv_amounts = await session.stream(
+        select(InvoiceDB.vendor_name, InvoiceDB.total_amount)
+        .where(
+            InvoiceDB.created_by == user_id,
+            func.coalesce(InvoiceDB.total_amount, 0) != 0,
+        )
+        .execution_options(yield_per=STREAM_BATCH_SIZE)
+    )
+
     financial_graphs = {
         "cost_composition": [
-            {"label": "Subtotal", "value": sum(subtotals)},
-            {"label": "Tax", "value": sum(taxes)},
-            {"label": "Discount", "value": -sum(discounts)},
+            {"label": "Subtotal", "value": subtotal_sum},
+            {"label": "Tax", "value": tax_sum},
+            {"label": "Discount", "value": -discount_sum},
         ],
         "invoice_amount_distribution": [
-            {"x": i.vendor_name or "Unknown", "y": to_float(i.total_amount)}
-            for i in invoices if i.total_amount
+            {"x": name or "Unknown", "y": to_float(amount)}
+            async for name, amount in inv_amounts
         ],
     }
 
     # ---------------------- 3. VENDOR ANALYTICS ----------------------
-    vendor_data = {}
-    for doc in all_docs:
-        if not doc.vendor_name:
-            continue
-        name = doc.vendor_name
-        vendor_data.setdefault(name, {"count": 0, "total_value": 0.0})
-        vendor_data[name]["count"] += 1
-        vendor_data[name]["total_value"] += to_float(doc.total_amount)
-
-    top_vendors = sorted(
-        [{"vendor": k, **v} for k, v in vendor_data.items()],
-        key=lambda x: x["total_value"],
-        reverse=True,
-    )[:10]
+    vendor_value = func.coalesce(func.sum(user_docs.c.total_amount), 0.0)
+    top_vendor_rows = await session.execute(
+        select(user_docs.c.vendor_name, func.count(), vendor_value)
+        .where(named_vendor)
+        .group_by(user_docs.c.vendor_name)
+        .order_by(vendor_value.desc())
+        .limit(10)
+    )
+    top_vendors = [
+        {"vendor": name, "count": count, "total_value": value}
+        for name, count, value in top_vendor_rows
+    ]
 
     vendor_analytics = {
-        "vendor_count": len(vendor_data),
+        "vendor_count": unique_vendors,
         "top_vendors_by_value": top_vendors,
-        "avg_docs_per_vendor": safe_mean([v["count"] for v in vendor_data.values()]),
+        "avg_docs_per_vendor": ratio_mean(vendor_doc_count, unique_vendors),
     }
 
     vendor_graphs = {
@@ -147,48 +239,54 @@ async def get_user_eda(session: AsyncSession, user_id: int) -> Dict[str, Any]:
     }
 
     # ---------------------- 5. DISCREPANCY INSIGHTS ----------------------
+    is_list = func.jsonb_typeof(CompareResponseDB.discrepancy) == "array"
+    comp_rows = await session.stream(
+        select(
+            CompareResponseDB.id,
+            is_list,
+            case((is_list, func.jsonb_array_length(CompareResponseDB.discrepancy)), else_=0),
+        )
+        .where(CompareResponseDB.created_by == user_id)
+        .order_by(CompareResponseDB.id)
+        .execution_options(yield_per=STREAM_BATCH_SIZE)
+    )
+    # One sweep feeds the count, the mean and the trend series
+    total_comparisons, listed_count, listed_sum = 0, 0, 0
+    discrepancy_trend = []
+    async for comp_id, listed, length in comp_rows:
+        total_comparisons += 1
+        if listed:
+            listed_count += 1
+            listed_sum += length
+        discrepancy_trend.append({"x": comp_id, "y": length})
+    latest_summary = (
+        await session.execute(
+            select(CompareResponseDB.summary)
+            .where(CompareResponseDB.created_by == user_id)
+            .order_by(CompareResponseDB.id.desc())
+            .limit(1)
+        )
+    ).scalar_one_or_none()
+
     discrepancy_insights = {
-        "total_comparisons": len(comparisons),
-        "avg_discrepancies_per_comparison": safe_mean(
-            [len(c.discrepancy) for c in comparisons if isinstance(c.discrepancy, list)]
-        ),
-        "most_recent_summary": comparisons[-1].summary if comparisons else None,
+        "total_comparisons": total_comparisons,
+        "avg_discrepancies_per_comparison": ratio_mean(listed_sum, listed_count),
+        "most_recent_summary": latest_summary,
     }
 
     discrepancy_graphs = {
-        "discrepancy_trend": [
-            {
-                "x": c.id,
-                "y": len(c.discrepancy) if isinstance(c.discrepancy, list) else 0,
-            }
-            for c in comparisons
-        ]
+        "discrepancy_trend": discrepancy_trend
     }
 
     # ---------------------- 6. LINE ITEM ANALYSIS ----------------------
-    item_counts = {}
-    for doc in all_docs:
-        if not doc.line_items:
-            continue
-        for item in doc.line_items:
-            name = item.get("item") or item.get("description")
-            if not name:
-                continue
-            qty = to_float(item.get("qty", 0))
-            price = to_float(item.get("price", 0))
-            if name not in item_counts:
-                item_counts[name] = {"qty": 0, "total_value": 0}
-            item_counts[name]["qty"] += qty
-            item_counts[name]["total_value"] += qty * price
-
-    top_items = sorted(
-        [{"item": k, **v} for k, v in item_counts.items()],
-        key=lambda x: x["total_value"],
-        reverse=True,
-    )[:10]
+    item_rows = (await session.execute(LINE_ITEM_SQL, {"user_id": user_id})).all()
+    top_items = [
+        {"item": row.name, "qty": row.qty, "total_value": row.total_value}
+        for row in item_rows
+    ]
 
     line_item_analysis = {
-        "unique_items": len(item_counts),
+        "unique_items": item_rows[0].unique_items if item_rows else 0,
         "top_items_by_value": top_items,
     }
 
@@ -202,28 +300,27 @@ async def get_user_eda(session: AsyncSession, user_id: int) -> Dict[str, Any]:
     }
 
     # ---------------------- 7. TEMPORAL TRENDS ----------------------
-    def parse_date(date_str):
-        if not date_str:
-            return None
-        for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d"):
-            try:
-                return datetime.strptime(date_str, fmt).date()
-            except:
-                continue
-        return None
+    # Dates are stored as free-form strings, so date_trunc cannot be used.
+    # Postgres sums amounts per distinct date string; each distinct string is
+    # then parsed once here instead of once per document.
+    date_key = func.coalesce(func.nullif(user_docs.c.invoice_date, ""), user_docs.c.po_date)
+    date_rows = await session.execute(
+        select(date_key, func.coalesce(func.sum(user_docs.c.total_amount), 0.0))
+        .where(date_key.isnot(None), date_key != "")
+        .group_by(date_key)
+    )
 
     monthly_totals = {}
-    for doc in all_docs:
-        date_field = parse_date(doc.invoice_date or doc.po_date)
+    for date_str, total_amount in date_rows:
+        date_field = parse_date(date_str)
         if not date_field:
             continue
         month_key = date_field.strftime("%Y-%m")
-        monthly_totals[month_key] = monthly_totals.get(month_key, 0) + to_float(
-            doc.total_amount
-        )
+        monthly_totals[month_key] = monthly_totals.get(month_key, 0) + total_amount
+    monthly_totals = dict(sorted(monthly_totals.items()))
 
     temporal_trends = {
-        "monthly_total_values": dict(sorted(monthly_totals.items())),
+        "monthly_total_values": monthly_totals,
         "months_active": len(monthly_totals),
         "first_month": next(iter(monthly_totals.keys()), None),
         "last_month": next(reversed(monthly_totals.keys()), None),
@@ -232,7 +329,7 @@ async def get_user_eda(session: AsyncSession, user_id: int) -> Dict[str, Any]:
     temporal_graphs = {
         "monthly_spending_trend": [
             {"x": month, "y": value}
-            for month, value in sorted(monthly_totals.items())
+            for month, value in monthly_totals.items()
         ]
     }
 
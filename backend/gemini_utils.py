@@ -1,58 +1,204 @@
 import httpx
 import asyncio
-import json
-from typing import Dict, Any
+import copy
+import hashlib
+import logging
+import orjson
+from dataclasses import field, fields, make_dataclass
+from typing import Dict, Any, List, Optional, Tuple
+from cachetools import TTLCache
+from tenacity import (
+    AsyncRetrying,
+    RetryError,
+    before_sleep_log,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 from fastapi import HTTPException
 import os
+import sys
 import dotenv
 
 dotenv.load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 GEMINI_API_URL_BASE = "https://generativelanguage.googleapis.com/v1beta/models/"
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Read once at import; the same interned string backs the client's auth header.
+GEMINI_API_KEY = sys.intern(os.getenv("GEMINI_API_KEY") or "")
+
+# One pooled client per process: calls reuse open TLS connections (and
+# multiplex over HTTP/2) instead of handshaking with Gemini every time.
+_client: Optional[httpx.AsyncClient] = None
+
+# Exact-match cache of parsed responses, keyed on model + payload. Re-submitted
+# documents (retries, re-renders) skip the Gemini round trip entirely.
+_response_cache: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+
+
+def _cache_key(model: str, payload: Dict[str, Any]) -> str:
+    # orjson (unlike json) understands the pre-serialized schema Fragment
+    raw = orjson.dumps({"m": model, "p": payload}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(raw).hexdigest()
+
+# Gemini statuses worth retrying; other 4xx (bad key, bad request) fail fast.
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+MAX_BACKOFF_SECONDS = 30
+
+# Upper bound on in-flight Gemini requests per process, sized to the API quota.
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+_request_slots = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, httpx.RequestError)
+
+
+_URLS: Dict[str, str] = {}
+
+
+def _url_for(model: str) -> str:
+    url = _URLS.get(model)
+    if url is None:
+        url = _URLS[model] = f"{GEMINI_API_URL_BASE}{model}:generateContent"
+    return url
+
+# Bodies above this size are decoded on a worker thread to keep the loop responsive
+LARGE_JSON_BYTES = 32_768
+
+
+async def _loads(data):
+    if len(data) > LARGE_JSON_BYTES:
+        return await asyncio.to_thread(orjson.loads, data)
+    return orjson.loads(data)
+
+
+async def get_client() -> httpx.AsyncClient:
+    """Return the shared Gemini client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=True,
+            # Key travels as a header, never in the URL (or access logs)
+            # Compressed bodies are decoded natively (brotli / zlib) as aread() pulls them
+            headers={"x-goog-api-key": GEMINI_API_KEY, "accept-encoding": "br, gzip"},
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _client
+
+
+async def warmup_client() -> None:
+    """Open a pooled connection at startup so the first extraction skips the TLS handshake."""
+    client = await get_client()
+    try:
+        await client.get(GEMINI_API_URL_BASE.rstrip("/"), params={"pageSize": 1}, timeout=5.0)
+    except httpx.HTTPError as e:
+        logger.warning("Gemini warm-up failed: %s", e)
+
+
+async def close_client() -> None:
+    """Close the shared client; registered as an app shutdown handler."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _post_with_retries(
+    client: httpx.AsyncClient,
+    url: str,
+    payload: Dict[str, Any],
+    max_retries: int,
+    base_delay: float,
+) -> bytes:
+    """POST the payload and return the raw body, retrying transient failures.
+
+    Full-jitter exponential backoff keeps concurrent retries from stampeding.
+    Raises RetryError once attempts run out; non-retryable errors propagate as-is.
+    """
+    content = orjson.dumps(payload)
+    async for attempt in AsyncRetrying(
+        stop=stop_after_attempt(max_retries),
+        wait=wait_random_exponential(multiplier=base_delay, max=MAX_BACKOFF_SECONDS),
+        retry=retry_if_exception(_is_retryable),
+        before_sleep=before_sleep_log(logger, logging.WARNING),
+    ):
+        with attempt:
+            # A slot is held only for the request itself, not for backoff sleeps
+            async with _request_slots, client.stream(
+                "POST",
+                url,
+                content=content,
+                headers={"content-type": "application/json"},
+            ) as response:
+                response.raise_for_status()
+                return await response.aread()
+
 
 async def call_gemini_api(
     model: str, 
     payload: Dict[str, Any], 
     max_retries: int = 3, 
-    base_delay: int = 1
-) -> Dict[str, Any]:
+    base_delay: int = 1,
+    use_cache: bool = True,
+    response_type: Optional[type] = None,
+) -> Any:
     """
     Reusable function to call Gemini API with exponential backoff.
+    Identical (model, payload) calls are served from an in-process cache for an hour.
+    Returns the parsed dict, or response_type.from_dict(parsed) (e.g. Extraction) if given.
     """
-    url = f"{GEMINI_API_URL_BASE}{model}:generateContent?key={GEMINI_API_KEY}"
+    key = _cache_key(model, payload) if use_cache else None
+    if key is not None and key in _response_cache:
+        cached = _response_cache[key]
+        return response_type.from_dict(cached) if response_type else copy.deepcopy(cached)
+
+    url = _url_for(model)
     
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        for attempt in range(max_retries):
-            try:
-                response = await client.post(url, json=payload)
-                response.raise_for_status()
-                result = response.json()
-                
-                if not result.get("candidates"):
-                    raise HTTPException(status_code=500, detail="AI response was empty or malformed.")
-                
-                part = result["candidates"][0]["content"]["parts"][0]
-                if "text" not in part:
-                    raise HTTPException(status_code=500, detail="AI response did not contain text.")
-                
-                return json.loads(part["text"])
-
-            except httpx.RequestError as e:
-                print(f"Request failed: {e}. Retrying ({attempt + 1}/{max_retries})...")
-                await asyncio.sleep(base_delay * (2 ** attempt))
-            except httpx.HTTPStatusError as e:
-                print(f"HTTP error: {e}. Retrying ({attempt + 1}/{max_retries})...")
-                await asyncio.sleep(base_delay * (2 ** attempt))
-            except json.JSONDecodeError as e:
-                print(f"Failed to parse AI JSON response: {e}")
-                print(f"Raw AI response: {part.get('text', 'NO_TEXT_FOUND')}")
-                raise HTTPException(status_code=500, detail="Failed to parse AI JSON response.")
-            except Exception as e:
-                print(f"An unexpected error occurred: {e}")
-                raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+    client = await get_client()
+    text = None
+    try:
+        # Raw body goes straight into orjson; no intermediate str/json() pass
+        body = await _post_with_retries(client, url, payload, max_retries, base_delay)
+        result = await _loads(body)
 
+        try:
+            text = result["candidates"][0]["content"]["parts"][0]["text"]
+        except (KeyError, IndexError, TypeError):
+            raise HTTPException(status_code=500, detail="AI response was empty or malformed.")
+
+        parsed = await _loads(text)
+        if key is not None:
+            _response_cache[key] = copy.deepcopy(parsed)
+        return response_type.from_dict(parsed) if response_type else parsed
+
+    except RetryError as e:
+        logger.error("Gemini request failed after %d attempts: %s", max_retries, e.last_attempt.exception())
         raise HTTPException(status_code=504, detail="AI service request timed out after all retries.")
+    except httpx.HTTPStatusError as e:
+        logger.error("Gemini HTTP error: %s. Not retrying", e)
+        raise HTTPException(status_code=502, detail=f"AI service rejected the request ({e.response.status_code}).")
+    except orjson.JSONDecodeError as e:
+        logger.error("Failed to parse AI JSON response: %s", e)
+        logger.debug("Raw AI response: %s", text if text is not None else "NO_TEXT_FOUND")
+        raise HTTPException(status_code=500, detail="Failed to parse AI JSON response.")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Unexpected error calling Gemini")
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+
+async def call_gemini_api_many(specs: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Run several independent (model, payload) calls concurrently over the shared client.
+    Results come back in the order of specs; the first failure propagates.
+    """
+    return await asyncio.gather(*(call_gemini_api(model, payload) for model, payload in specs))
 
 EXTRACTION_MODEL = "gemini-2.5-flash-preview-09-2025"
 COMPARISON_MODEL = "gemini-2.5-flash-preview-09-2025"
@@ -131,6 +277,98 @@ EXTRACTION_SCHEMA = {
     "required": ["vendor_name", "total_amount", "line_items"]
 }
 
+# Minimal schema for callers that only need identifiers, the total and basic
+# line items: fewer output fields means fewer response tokens per document.
+# is_invoice and po_number stay in so the document can still be stored and linked.
+_CORE_FIELDS = ("vendor_name", "po_number", "invoice_id", "invoice_date", "po_date", "total_amount", "is_invoice")
+_CORE_LINE_FIELDS = ("description", "quantity", "unit_price", "total")
+_line_item_schema = EXTRACTION_SCHEMA["properties"]["line_items"]["items"]
+CORE_EXTRACTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        **{f: EXTRACTION_SCHEMA["properties"][f] for f in _CORE_FIELDS},
+        "line_items": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {f: _line_item_schema["properties"][f] for f in _CORE_LINE_FIELDS},
+                "required": _line_item_schema["required"],
+            },
+        },
+    },
+    "required": EXTRACTION_SCHEMA["required"],
+}
+
+# Slotted record types mirroring EXTRACTION_SCHEMA, for callers that walk the
+# extracted fields repeatedly and prefer attribute access over dict lookups.
+_SCHEMA_PY_TYPES = {"STRING": Optional[str], "NUMBER": Optional[float], "BOOLEAN": Optional[bool]}
+
+
+def _from_dict(cls, data: Dict[str, Any]):
+    return cls(**{f.name: data[f.name] for f in fields(cls) if f.name in data})
+
+
+def _extraction_from_dict(cls, data: Dict[str, Any]):
+    record = _from_dict(cls, data)
+    record.line_items = [ExtractedLineItem.from_dict(li) for li in data.get("line_items") or []]
+    return record
+
+
+def _schema_dataclass(name: str, properties: Dict[str, Any], extra_fields=(), from_dict=_from_dict):
+    """Build a slots dataclass with one optional field per scalar schema property."""
+    return make_dataclass(
+        name,
+        [
+            *(
+                (prop, _SCHEMA_PY_TYPES.get(spec["type"], Any), field(default=None))
+                for prop, spec in properties.items()
+                if spec["type"] != "ARRAY"
+            ),
+            *extra_fields,
+        ],
+        namespace={"from_dict": classmethod(from_dict)},
+        slots=True,
+    )
+
+
+ExtractedLineItem = _schema_dataclass(
+    "ExtractedLineItem", EXTRACTION_SCHEMA["properties"]["line_items"]["items"]["properties"]
+)
+Extraction = _schema_dataclass(
+    "Extraction",
+    EXTRACTION_SCHEMA["properties"],
+    extra_fields=[("line_items", List[ExtractedLineItem], field(default_factory=list))],
+    from_dict=_extraction_from_dict,
+)
+
+# Static parts of every extraction request, built once. Keeping the
+# instruction text and generationConfig byte-identical across calls (with the
+# per-document image last) lets Gemini's implicit prefix caching apply.
+EXTRACTION_PROMPT = (
+    "You are an expert OCR and data extraction service. "
+    "Analyze the provided document image (invoice or PO) and extract key information "
+    "according to the provided JSON schema. "
+    "If a field is not present, omit it from the JSON."
+    "Provide is_invoice as true for invoices, false for purchase orders."
+)
+# The schema is serialized once; orjson splices the Fragment's bytes into each
+# request body instead of walking the nested dicts on every call.
+EXTRACTION_SCHEMA_JSON = orjson.Fragment(orjson.dumps(EXTRACTION_SCHEMA))
+CORE_EXTRACTION_SCHEMA_JSON = orjson.Fragment(orjson.dumps(CORE_EXTRACTION_SCHEMA))
+EXTRACTION_GENERATION_CONFIG = {
+    "responseMimeType": "application/json",
+    "responseSchema": EXTRACTION_SCHEMA_JSON,
+}
+CORE_EXTRACTION_GENERATION_CONFIG = {
+    "responseMimeType": "application/json",
+    "responseSchema": CORE_EXTRACTION_SCHEMA_JSON,
+}
+# Extraction mode ("core" | "full") -> generationConfig
+EXTRACTION_GENERATION_CONFIGS = {
+    "core": CORE_EXTRACTION_GENERATION_CONFIG,
+    "full": EXTRACTION_GENERATION_CONFIG,
+}
+
 
 COMPARISON_SCHEMA = {
     "type": "OBJECT",
@@ -4,22 +4,31 @@ Requirements:
     pip install fastapi uvicorn google-auth google-auth-oauthlib google-auth-httplib2 google-api-python-client python-jose[cryptography] python-multipart motor pymongo python-dotenv
 """
 
-from fastapi import FastAPI, HTTPException, Depends, Request, Response, Cookie, Header
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, Cookie, Header, BackgroundTasks, Query
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request as GoogleAuthRequest
+from google.auth.exceptions import RefreshError
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
-from db import get_async_session
-from models import GmailUser, GmailEmail, OAuthState, GmailSenderStat, EmailEvent
+from sqlalchemy import select, delete, insert, update, func, literal_column, tuple_, null
+from sqlalchemy.orm import load_only, undefer
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from db import get_async_session, async_session_maker
+from models import GmailUser, GmailEmail, OAuthState, GmailSenderStat, GmailUserStat, EmailEvent, email_search_vector, email_sort_date
 import os
-import json
-from typing import Optional
+import re
+import asyncio
+import orjson
+from cachetools import TTLCache
+import logging
+from typing import Literal, Optional
 from datetime import datetime, timedelta, timezone
 import base64
+from email.utils import parseaddr
 from dotenv import load_dotenv, find_dotenv
 from contextlib import asynccontextmanager
 import jwt
@@ -28,10 +37,12 @@ import httpx
 
 load_dotenv(find_dotenv())
 
+logger = logging.getLogger(__name__)
+
 # UTC constant for timezone-aware datetimes
 UTC = timezone.utc
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Configuration - Store these in environment variables
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "your-client-id.apps.googleusercontent.com")
@@ -83,7 +94,26 @@ CLIENT_CONFIG = {
 @app.on_event("startup")
 async def startup_event():
     # Tables are created in backend/main.py
-    print("Postgres ready via SQLAlchemy AsyncSession")
+    logger.info("Postgres ready via SQLAlchemy AsyncSession")
+    global _token_refresh_task, _email_event_task, _oauth_state_cleanup_task
+    _token_refresh_task = asyncio.create_task(token_refresh_loop())
+    _email_event_task = asyncio.create_task(email_event_flusher())
+    _oauth_state_cleanup_task = asyncio.create_task(oauth_state_cleanup_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if _token_refresh_task:
+        _token_refresh_task.cancel()
+    if _oauth_state_cleanup_task:
+        _oauth_state_cleanup_task.cancel()
+    if _email_event_task:
+        # Let queued events reach the database before the engine is disposed
+        try:
+            await asyncio.wait_for(_email_event_queue.join(), timeout=EMAIL_EVENT_DRAIN_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d unwritten email events at shutdown", _email_event_queue.qsize())
+        _email_event_task.cancel()
 
 
 def credentials_to_dict(credentials):
@@ -94,7 +124,9 @@ def credentials_to_dict(credentials):
         'token_uri': credentials.token_uri,
         'client_id': credentials.client_id,
         'client_secret': credentials.client_secret,
-        'scopes': credentials.scopes
+        'scopes': credentials.scopes,
+        # Naive UTC ISO string (or None until the first refresh); the token refresher queries on it
+        'expiry': credentials.expiry.isoformat() if credentials.expiry else None,
     }
 
 
@@ -106,10 +138,143 @@ def dict_to_credentials(creds_dict):
         token_uri=creds_dict['token_uri'],
         client_id=creds_dict['client_id'],
         client_secret=creds_dict['client_secret'],
-        scopes=creds_dict['scopes']
+        scopes=creds_dict['scopes'],
+        expiry=datetime.fromisoformat(creds_dict['expiry']) if creds_dict.get('expiry') else None,
     )
 
 
+# Columns needed by the Gmail API paths (service, history sync, watch); skips user_info and login fields
+GMAIL_SERVICE_FIELDS = load_only(GmailUser.email, GmailUser.credentials, GmailUser.history_id)
+
+# Per-user (credentials, Gmail service): reuses the built client and the last refreshed token
+_service_cache = {}
+TOKEN_REFRESH_MARGIN = timedelta(seconds=60)
+
+# Background refresher: renews tokens expiring within TOKEN_REFRESH_AHEAD so webhooks find them valid
+TOKEN_REFRESH_INTERVAL_SECONDS = int(os.getenv("TOKEN_REFRESH_INTERVAL_SECONDS", "240"))
+TOKEN_REFRESH_AHEAD = timedelta(minutes=5)
+_token_refresh_task = None
+# Literal key (not a bound parameter) so the query matches the ix_gmail_users_credentials_expiry expression
+CREDENTIALS_EXPIRY = GmailUser.credentials[literal_column("'expiry'")].astext
+
+
+# googleapiclient calls and token refreshes block, and a user's cached service shares one
+# httplib2 connection, which is not thread-safe: they run in worker threads, one at a time per user
+_gmail_locks: dict = {}
+
+
+def gmail_lock(user_email: str) -> asyncio.Lock:
+    """Lock serializing Gmail API calls and token refreshes for one user"""
+    return _gmail_locks.setdefault(user_email, asyncio.Lock())
+
+
+async def run_gmail(user_email: str, fn, *args, **kwargs):
+    """Run a blocking Gmail API call (e.g. request.execute) off the event loop"""
+    async with gmail_lock(user_email):
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+def get_cached_credentials(user: GmailUser):
+    """Return the cached (credentials, service) pair for the user, building it on first use"""
+    cached = _service_cache.get(user.email)
+    if cached and cached[0].refresh_token == user.credentials.get('refresh_token'):
+        return cached
+    credentials = dict_to_credentials(user.credentials)
+    # Discovery document comes from the copy bundled with google-api-python-client, not an HTTP fetch
+    service = build('gmail', 'v1', credentials=credentials, static_discovery=True, cache_discovery=False)
+    _service_cache[user.email] = (credentials, service)
+    return credentials, service
+
+
+def needs_refresh(credentials: Credentials) -> bool:
+    """True when the access token expires within TOKEN_REFRESH_MARGIN"""
+    # Expiry is only known after a refresh; google-auth refreshes on 401 until then
+    return bool(credentials.expiry) and credentials.expiry <= datetime.utcnow() + TOKEN_REFRESH_MARGIN
+
+
+async def get_gmail_service(user: GmailUser):
+    """
+    Return a cached Gmail service for the user, refreshing the token only when it is about to expire.
+    Concurrent requests share one refresh: the first takes the user's lock, the rest find a fresh token.
+    A refreshed token is written back to user.credentials (committed with the caller's session)
+    only when it differs from the stored one.
+    """
+    credentials, service = get_cached_credentials(user)
+
+    if needs_refresh(credentials):
+        async with gmail_lock(user.email):
+            if needs_refresh(credentials):
+                await asyncio.to_thread(credentials.refresh, GoogleAuthRequest())
+
+    if credentials.token != user.credentials.get('token'):
+        user.credentials = credentials_to_dict(credentials)
+    return service
+
+
+async def refresh_expiring_tokens():
+    """
+    Refresh every stored token of a logged-in user that expires within TOKEN_REFRESH_AHEAD
+    and persist the new ones. A token Google refuses to refresh (revoked or expired grant)
+    has its stored expiry cleared, so later sweeps skip it until the user logs in again.
+    """
+    cutoff = (datetime.utcnow() + TOKEN_REFRESH_AHEAD).isoformat()
+    async with async_session_maker() as session:
+        res = await session.execute(
+            select(GmailUser)
+            .where(CREDENTIALS_EXPIRY < cutoff, GmailUser.logged_out_at.is_(None))
+            .options(GMAIL_SERVICE_FIELDS)
+        )
+        for user in res.scalars():
+            try:
+                credentials, _ = get_cached_credentials(user)
+                await run_gmail(user.email, credentials.refresh, GoogleAuthRequest())
+                user.credentials = credentials_to_dict(credentials)
+            except RefreshError as error:
+                logger.warning("Token refresh rejected for %s, skipping until next login: %s", user.email, error)
+                user.credentials = {**user.credentials, 'expiry': None}
+                _service_cache.pop(user.email, None)
+            except Exception:
+                logger.exception("Token refresh failed for %s", user.email)
+        await session.commit()
+
+
+async def token_refresh_loop():
+    """Run refresh_expiring_tokens every TOKEN_REFRESH_INTERVAL_SECONDS until cancelled"""
+    while True:
+        try:
+            await refresh_expiring_tokens()
+        except Exception:
+            logger.exception("Token refresh sweep failed")
+        await asyncio.sleep(TOKEN_REFRESH_INTERVAL_SECONDS)
+
+
+# Abandoned logins leave their OAuthState behind; expired states are swept periodically
+OAUTH_STATE_CLEANUP_INTERVAL_SECONDS = 300
+OAUTH_STATE_GRACE = timedelta(hours=1)
+_oauth_state_cleanup_task = None
+
+
+async def delete_expired_oauth_states():
+    """Delete OAuth states that expired more than OAUTH_STATE_GRACE ago"""
+    async with async_session_maker() as session:
+        res = await session.execute(
+            delete(OAuthState).where(OAuthState.expires_at < datetime.utcnow() - OAUTH_STATE_GRACE)
+        )
+        await session.commit()
+    if res.rowcount:
+        logger.info("Deleted %d expired OAuth states", res.rowcount)
+
+
+async def oauth_state_cleanup_loop():
+    """Run delete_expired_oauth_states every OAUTH_STATE_CLEANUP_INTERVAL_SECONDS until cancelled"""
+    while True:
+        try:
+            await delete_expired_oauth_states()
+        except Exception:
+            logger.exception("OAuth state cleanup failed")
+        await asyncio.sleep(OAUTH_STATE_CLEANUP_INTERVAL_SECONDS)
+
+
 def create_access_token(user_email: str, user_data: dict) -> str:
     """Create JWT access token for authenticated user"""
     payload = {
@@ -150,8 +315,12 @@ async def get_current_user(authorization: Optional[str] = Header(None), session:
     if not user_email:
         raise HTTPException(status_code=401, detail="Invalid token payload")
     
-    # Verify user exists in database
-    res_user = await session.execute(select(GmailUser).where(GmailUser.email == user_email))
+    # Verify user exists in database (only the fields returned below; never the credentials)
+    res_user = await session.execute(
+        select(GmailUser)
+        .where(GmailUser.email == user_email)
+        .options(load_only(GmailUser.email, GmailUser.user_info, GmailUser.last_login, GmailUser.logged_out_at))
+    )
     user = res_user.scalar_one_or_none()
     
     if not user:
@@ -203,15 +372,14 @@ async def login(session: AsyncSession = Depends(get_async_session)):
 async def auth_callback(code: str, state: str, session: AsyncSession = Depends(get_async_session)):
     """Handle OAuth callback"""
     try:
-        # Verify state
-        res = await session.execute(select(OAuthState).where(OAuthState.state == state))
-        state_row = res.scalar_one_or_none()
-        if not state_row or state_row.expires_at < datetime.utcnow():
-            raise HTTPException(status_code=400, detail="Invalid or expired state")
-        
-        # Delete used state
-        await session.execute(delete(OAuthState).where(OAuthState.state == state))
+        # Verify and consume the state in one statement (a state can only be used once)
+        res = await session.execute(
+            delete(OAuthState).where(OAuthState.state == state).returning(OAuthState.expires_at)
+        )
+        expires_at = res.scalar_one_or_none()
         await session.commit()
+        if not expires_at or expires_at < datetime.utcnow():
+            raise HTTPException(status_code=400, detail="Invalid or expired state")
         
         flow = Flow.from_client_config(
             CLIENT_CONFIG,
@@ -220,33 +388,29 @@ async def auth_callback(code: str, state: str, session: AsyncSession = Depends(g
         )
         
         # Exchange authorization code for credentials
-        flow.fetch_token(code=code)
+        await asyncio.to_thread(flow.fetch_token, code=code)
         credentials = flow.credentials
         
         # Get user info
-        user_info_service = build('oauth2', 'v2', credentials=credentials)
-        user_info = user_info_service.userinfo().get().execute()
+        user_info_service = build('oauth2', 'v2', credentials=credentials, static_discovery=True, cache_discovery=False)
+        user_info = await asyncio.to_thread(user_info_service.userinfo().get().execute)
         
         user_email = user_info.get('email')
         
-        # Store/update user in Postgres
-        res_user = await session.execute(select(GmailUser).where(GmailUser.email == user_email))
-        user_row = res_user.scalar_one_or_none()
-        if not user_row:
-            user_row = GmailUser(
-                email=user_email,
-                user_info=user_info,
-                credentials=credentials_to_dict(credentials),
-                last_login=datetime.utcnow(),
-                logged_out_at=None,
-            )
-            session.add(user_row)
-        else:
-            user_row.user_info = user_info
-            user_row.credentials = credentials_to_dict(credentials)
-            user_row.last_login = datetime.utcnow()
-            user_row.logged_out_at = None
+        # Store/update user in Postgres with a single upsert
+        user_values = {
+            "user_info": user_info,
+            "credentials": credentials_to_dict(credentials),
+            "last_login": datetime.utcnow(),
+            "logged_out_at": None,
+        }
+        await session.execute(
+            pg_insert(GmailUser)
+            .values(email=user_email, **user_values)
+            .on_conflict_do_update(index_elements=[GmailUser.email], set_=user_values)
+        )
         await session.commit()
+        _service_cache.pop(user_email, None)
         
         # Set up Gmail watch for this user
         await setup_gmail_watch(user_email, session)
@@ -276,13 +440,12 @@ async def setup_gmail_watch(user_email: str, session: AsyncSession = Depends(get
     """
     
     try:
-        res_user = await session.execute(select(GmailUser).where(GmailUser.email == user_email))
+        res_user = await session.execute(select(GmailUser).where(GmailUser.email == user_email).options(GMAIL_SERVICE_FIELDS))
         user = res_user.scalar_one_or_none()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        credentials = dict_to_credentials(user.credentials)
-        service = build('gmail', 'v1', credentials=credentials)
+        service = await get_gmail_service(user)
         
         # Watch request - monitors inbox for new messages
         request = {
@@ -290,92 +453,100 @@ async def setup_gmail_watch(user_email: str, session: AsyncSession = Depends(get
             'topicName': 'projects/hackx3/topics/gmail-notifications'
         }
         
-        response = service.users().watch(userId='me', body=request).execute()
+        response = await run_gmail(user_email, service.users().watch(userId='me', body=request).execute)
         
         # Update user with watch info
         expiration = datetime.utcnow() + timedelta(milliseconds=int(response['expiration']))
         user.watch_expiration = expiration
         user.history_id = response['historyId']
         await session.commit()
+        invalidate_user_caches(user_email)
         
-        print(f"Gmail watch set up for {user_email}, expires at {expiration}")
+        logger.info("Gmail watch set up for %s, expires at %s", user_email, expiration)
         return response
         
     except HttpError as error:
-        print(f"An error occurred setting up watch: {error}")
+        logger.error("An error occurred setting up watch for %s: %s", user_email, error)
         raise
 
 
 @app.post("/webhook/gmail")
-async def gmail_webhook(request: Request, session: AsyncSession = Depends(get_async_session)):
+async def gmail_webhook(request: Request, background_tasks: BackgroundTasks):
     """
     Webhook endpoint for Gmail push notifications
     
     Google Pub/Sub will POST to this endpoint when new emails arrive.
     Set up a Pub/Sub push subscription pointing to this URL.
+    The Gmail sync runs after the response is sent, so Pub/Sub gets its 200 immediately.
     """
     
     try:
         body = await request.body()
         if not body:
-            print("⚠️ Empty body received from Pub/Sub")
+            logger.warning("Empty body received from Pub/Sub")
             return {"status": "no_body"}
         
-        data = json.loads(body.decode("utf-8"))
-        print("✅ Raw Pub/Sub push:", data)
+        data = orjson.loads(body)
+        logger.debug("Raw Pub/Sub push: %s", data)
         
         message = data.get("message", {})
         if "data" in message:
-            decoded_data = base64.b64decode(message["data"]).decode("utf-8")
-            print("📩 Decoded message data:", decoded_data)
+            decoded_data = base64.b64decode(message["data"])
+            logger.debug("Decoded message data: %s", decoded_data)
             
             # Parse the notification data
-            notification_data = json.loads(decoded_data)
+            notification_data = orjson.loads(decoded_data)
             email_address = notification_data.get("emailAddress")
             history_id = notification_data.get("historyId")
             
-            print(f"📧 Email: {email_address}, History ID: {history_id}")
+            logger.info("Gmail notification for %s, history ID %s", email_address, history_id)
             
             # Process the new emails in the background
             if email_address and history_id:
-                await process_new_emails(email_address, str(history_id), session)
+                background_tasks.add_task(process_new_emails_task, email_address, str(history_id))
         else:
-            print("⚠️ No 'data' field in message")
+            logger.warning("No 'data' field in Pub/Sub message")
 
         # Always return 200 so Pub/Sub knows we received it
         return {"status": "ok"}
 
     except Exception as e:
-        print(f"❌ Error processing webhook: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error processing webhook")
         return {"status": "error", "detail": str(e)}
 
 
+async def process_new_emails_task(email_address: str, new_history_id: str):
+    """Background entry point: runs the sync in its own session (the request's is closed by then)."""
+    try:
+        async with async_session_maker() as session:
+            await process_new_emails(email_address, new_history_id, session)
+    except Exception:
+        logger.exception("Background email sync failed for %s", email_address)
+
+
 async def process_new_emails(email_address: str, new_history_id: str, session: AsyncSession):
     """
     Process new emails by fetching history since last check
     """
     
-    res_user = await session.execute(select(GmailUser).where(GmailUser.email == email_address))
+    res_user = await session.execute(select(GmailUser).where(GmailUser.email == email_address).options(GMAIL_SERVICE_FIELDS))
     user = res_user.scalar_one_or_none()
     if not user:
-        print(f"No user found for {email_address}")
+        logger.warning("No user found for %s", email_address)
         return
     
     try:
-        credentials = dict_to_credentials(user.credentials)
-        service = build('gmail', 'v1', credentials=credentials)
+        service = await get_gmail_service(user)
         
         last_history_id = user.history_id
         
         if not last_history_id:
-            print("No history_id found, fetching latest emails instead")
+            logger.info("No history_id for %s, fetching the latest email instead", email_address)
             # If no history_id, fetch the most recent email
-            messages_response = service.users().messages().list(
+            messages_response = await run_gmail(email_address, service.users().messages().list(
                 userId='me',
                 maxResults=1
-            ).execute()
+            ).execute)
             
             if messages_response.get('messages'):
                 message_id = messages_response['messages'][0]['id']
@@ -385,80 +556,161 @@ async def process_new_emails(email_address: str, new_history_id: str, session: A
             user.history_id = new_history_id
             user.last_sync = datetime.now(UTC)
             await session.commit()
+            await flush_email_events(session)
+            invalidate_user_caches(email_address)
             return
         
-        print(f"Fetching history from {last_history_id} to {new_history_id}")
+        logger.debug("Fetching history from %s to %s", last_history_id, new_history_id)
         
         # Fetch history since last check
-        history_response = service.users().history().list(
+        history_response = await run_gmail(email_address, service.users().history().list(
             userId='me',
             startHistoryId=last_history_id,
             historyTypes=['messageAdded']
-        ).execute()
+        ).execute)
         
-        # Update stored history_id
+        # Update stored history_id (committed together with the stored emails)
         user.history_id = new_history_id
         user.last_sync = datetime.now(UTC)
-        await session.commit()
         
         if 'history' not in history_response:
-            print("No new messages in history")
+            logger.debug("No new messages in history")
+            await session.commit()
+            invalidate_user_caches(email_address)
             return
         
-        print(f"Found {len(history_response['history'])} history items")
+        logger.debug("Found %d history items", len(history_response['history']))
         
-        # Process each new message
-        for history_item in history_response['history']:
-            if 'messagesAdded' in history_item:
-                for message_added in history_item['messagesAdded']:
-                    message_data = message_added['message']
-                    message_id = message_data['id']
-                    
-                    print(f"Processing message ID: {message_id}")
-                    await fetch_and_store_email(service, email_address, message_id, session)
+        # History can repeat a message across items; keep first-seen order without duplicates
+        message_ids = list(dict.fromkeys(
+            message_added['message']['id']
+            for history_item in history_response['history']
+            for message_added in history_item.get('messagesAdded', [])
+        ))
         
-    except HttpError as error:
-        print(f"An error occurred fetching emails: {error}")
-        import traceback
-        traceback.print_exc()
+        # Skip messages that are already stored
+        if message_ids:
+            res_stored = await session.execute(
+                select(GmailEmail.message_id).where(GmailEmail.message_id.in_(message_ids))
+            )
+            stored_ids = set(res_stored.scalars().all())
+            message_ids = [message_id for message_id in message_ids if message_id not in stored_ids]
+        
+        # Fetch all new messages in batched HTTP requests and store them with bulk upserts
+        messages = await run_gmail(email_address, fetch_messages_batch, service, message_ids)
+        prepared = []
+        for message in messages:
+            try:
+                prepared.append((prepare_email_info(email_address, message), message))
+            except Exception:
+                logger.exception("Error extracting message %s", message['id'])
+        await store_emails_bulk([email_info for email_info, _ in prepared], session)
+        for email_info, message in prepared:
+            await handle_new_email(email_address, email_info, message, session)
+        
+        # One commit for the whole batch: emails, derived fields, stats; events are queued after it
+        await session.commit()
+        await flush_email_events(session)
+        invalidate_user_caches(email_address)
+        
+    except HttpError:
+        logger.exception("Gmail API error fetching emails for %s", email_address)
+
+
+# Only what extract_email_info/_body/_attachments_info read: skips per-part headers,
+# sizeEstimate and historyId from every message response
+GMAIL_PART_FIELDS = "partId,mimeType,filename,body(size,attachmentId,data)"
+
+
+def gmail_part_fields(depth: int) -> str:
+    """Field mask for nested message parts; below `depth` levels whole parts are returned"""
+    if depth == 0:
+        return "parts"
+    return f"parts({GMAIL_PART_FIELDS},{gmail_part_fields(depth - 1)})"
+
+
+GMAIL_MESSAGE_FIELDS = (
+    f"id,threadId,labelIds,snippet,internalDate,payload(headers,{GMAIL_PART_FIELDS},{gmail_part_fields(4)})"
+)
+
+# Gmail rejects batch requests with more than 100 calls
+GMAIL_BATCH_LIMIT = 100
+
+
+def fetch_messages_batch(service, message_ids: list) -> list:
+    """Fetch full messages for all ids with Gmail batch requests of up to GMAIL_BATCH_LIMIT calls.
+    
+    Messages that fail to fetch are logged and skipped; order follows message_ids.
+    """
+    if not message_ids:
+        return []
+    
+    fetched = {}
+    
+    def on_message(request_id, response, exception):
+        if exception is not None:
+            logger.error("Error fetching message %s: %s", request_id, exception)
+        else:
+            fetched[request_id] = response
+    
+    for start in range(0, len(message_ids), GMAIL_BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=on_message)
+        for message_id in message_ids[start:start + GMAIL_BATCH_LIMIT]:
+            batch.add(
+                service.users().messages().get(userId='me', id=message_id, format='full', fields=GMAIL_MESSAGE_FIELDS),
+                request_id=message_id,
+            )
+        batch.execute()
+    
+    return [fetched[mid] for mid in message_ids if mid in fetched]
 
 
 async def fetch_and_store_email(service, email_address: str, message_id: str, session: AsyncSession):
     """Fetch full email details and store in Postgres"""
     try:
         # Fetch full message details with metadata and body
-        message = service.users().messages().get(
+        message = await run_gmail(email_address, service.users().messages().get(
             userId='me',
             id=message_id,
-            format='full'
-        ).execute()
-        
-        print(f"🔍 Fetching message: {message_id}")
-        
-        # Extract email information
-        email_info = extract_email_info(message)
-        email_info['user_email'] = email_address
-        
-        # Extract email body (plain text and HTML)
-        body_data = extract_email_body(message)
-        email_info.update(body_data)
-        
-        # Extract attachments metadata
-        attachments_info = extract_attachments_info(message)
-        print(f"🔍 Extracted {len(attachments_info)} attachments")
+            format='full',
+            fields=GMAIL_MESSAGE_FIELDS,
+        ).execute)
         
-        if attachments_info:
-            email_info['attachments'] = attachments_info
-            email_info['has_attachments'] = True
-            print(f"📎 Attachments to store: {attachments_info}")
+        logger.debug("Fetched message: %s", message_id)
+        await store_fetched_email(email_address, message, session)
         
-        # Debug: Print what we're about to store
-        print(f"📦 Email info to store:")
-        print(f"   - message_id: {email_info.get('message_id')}")
-        print(f"   - has_attachments: {email_info.get('has_attachments', False)}")
-        print(f"   - attachments count: {len(email_info.get('attachments', []))}")
-        if email_info.get('attachments'):
-            print(f"   - attachments data: {json.dumps(email_info['attachments'], indent=6)}")
+    except HttpError:
+        logger.exception("Error fetching message %s", message_id)
+
+
+def prepare_email_info(email_address: str, message: dict) -> dict:
+    """Extract everything stored for a fetched Gmail message: headers, bodies, attachments, derived fields"""
+    # Extract email information
+    email_info = extract_email_info(message)
+    email_info['user_email'] = email_address
+    
+    # Extract email body (plain text and HTML)
+    body_data = extract_email_body(message)
+    email_info.update(body_data)
+    
+    # Extract attachments metadata
+    attachments_info = extract_attachments_info(message)
+    
+    if attachments_info:
+        email_info['attachments'] = attachments_info
+        email_info['has_attachments'] = True
+        logger.debug("Attachments to store for %s: %s", message['id'], attachments_info)
+    
+    # Derived fields (priority, domain, category) go into the same row write
+    enrich_email_info(email_info)
+    return email_info
+
+
+async def store_fetched_email(email_address: str, message: dict, session: AsyncSession):
+    """Extract, store and post-process an already fetched Gmail message"""
+    message_id = message['id']
+    try:
+        email_info = prepare_email_info(email_address, message)
         
         # Store email in Postgres
         await store_email(email_info, session)
@@ -466,25 +718,28 @@ async def fetch_and_store_email(service, email_address: str, message_id: str, se
         # Call custom handler
         await handle_new_email(email_address, email_info, message, session)
         
-        print(f"✅ Stored email: {email_info['subject']}")
-        print(f"📧 From: {email_info['from']}")
-        print(f"📝 Body preview: {email_info['body_plain'][:100] if email_info.get('body_plain') else 'No plain text body'}...")
-        
-        if attachments_info:
-            print(f"📎 Attachments:")
-            for att in attachments_info:
-                print(f"   - {att['filename']} ({att['mime_type']}, {att['size']} bytes)")
-                print(f"     Attachment ID: {att['attachment_id']}")
-                # Generate download URL using filename (URL-encoded)
-                from urllib.parse import quote
-                encoded_filename = quote(att['filename'])
-                download_url = f"{BASE_URL}/user/emails/{message_id}/attachments/{encoded_filename}"
-                print(f"     🔗 Download: {download_url}")
+        logger.info(
+            "Stored email %s from %s with %d attachment(s)",
+            message_id, email_info['from'], len(email_info.get('attachments') or []),
+        )
         
-    except HttpError as error:
-        print(f"Error fetching message {message_id}: {error}")
-        import traceback
-        traceback.print_exc()
+    except HttpError:
+        logger.exception("Error processing message %s", message_id)
+
+
+def iter_parts(parts):
+    """
+    Walk nested message parts without recursion, yielding (part, depth).
+    A part's sub-parts are yielded before the part itself, the order the recursive parsers used.
+    """
+    stack = [(part, 0, False) for part in reversed(parts)]
+    while stack:
+        part, depth, expanded = stack.pop()
+        if 'parts' in part and not expanded:
+            stack.append((part, depth, True))
+            stack.extend((sub, depth + 1, False) for sub in reversed(part['parts']))
+            continue
+        yield part, depth
 
 
 def extract_email_body(message):
@@ -495,37 +750,21 @@ def extract_email_body(message):
         'body_snippet': message.get('snippet', '')
     }
     
-    def parse_parts(parts):
-        """Recursively parse message parts"""
-        plain_text = ''
-        html_text = ''
-        
-        for part in parts:
-            mime_type = part.get('mimeType', '')
-            
-            # Check if this part has nested parts
-            if 'parts' in part:
-                nested_plain, nested_html = parse_parts(part['parts'])
-                plain_text += nested_plain
-                html_text += nested_html
-            
-            # Extract body data
-            if 'body' in part and 'data' in part['body']:
-                body_data = part['body']['data']
-                decoded_body = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
-                
-                if mime_type == 'text/plain':
-                    plain_text += decoded_body
-                elif mime_type == 'text/html':
-                    html_text += decoded_body
-        
-        return plain_text, html_text
-    
     # Check if message has parts (multipart)
     if 'parts' in message['payload']:
-        plain, html = parse_parts(message['payload']['parts'])
-        body_data['body_plain'] = plain
-        body_data['body_html'] = html
+        plain_chunks = []
+        html_chunks = []
+        for part, _ in iter_parts(message['payload']['parts']):
+            data = part.get('body', {}).get('data')
+            if not data:
+                continue
+            mime_type = part.get('mimeType', '')
+            if mime_type == 'text/plain':
+                plain_chunks.append(base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore'))
+            elif mime_type == 'text/html':
+                html_chunks.append(base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore'))
+        body_data['body_plain'] = ''.join(plain_chunks)
+        body_data['body_html'] = ''.join(html_chunks)
     
     # Check if body is directly in payload (simple message)
     elif 'body' in message['payload'] and 'data' in message['payload']['body']:
@@ -547,52 +786,31 @@ def extract_email_body(message):
 def extract_attachments_info(message):
     """Extract attachment metadata from email"""
     attachments = []
-    
-    def parse_parts(parts, level=0):
-        """Recursively parse message parts for attachments"""
-        indent = "  " * level
-        for i, part in enumerate(parts):
-            part_id = part.get('partId', f'part-{i}')
-            mime_type = part.get('mimeType', '')
-            filename = part.get('filename', '')
-            
-            print(f"{indent}📄 Part {part_id}: {mime_type}, filename='{filename}'")
-            
-            # Check for nested parts
-            if 'parts' in part:
-                print(f"{indent}  ↳ Has {len(part['parts'])} sub-parts")
-                parse_parts(part['parts'], level + 1)
-            
-            # Check if this part has a body with attachmentId
-            body = part.get('body', {})
-            attachment_id = body.get('attachmentId')
-            size = body.get('size', 0)
-            
-            # An attachment either has a filename or an attachmentId with reasonable size
-            if filename and attachment_id:
-                attachment_info = {
-                    'filename': filename,
-                    'mime_type': mime_type,
-                    'size': size,
-                    'attachment_id': attachment_id,
-                    'part_id': part_id
-                }
-                attachments.append(attachment_info)
-                print(f"{indent}  ✅ Added attachment: {filename}")
-            elif filename and not attachment_id:
-                # Inline content without separate attachment
-                print(f"{indent}  ⚠️  File '{filename}' has no attachmentId (inline content)")
-            elif attachment_id:
-                # Attachment without filename (rare but possible)
-                print(f"{indent}  ⚠️  Attachment ID found but no filename")
-    
-    # Parse message parts
-    print("🔍 Parsing message structure:")
-    if 'parts' in message['payload']:
-        parse_parts(message['payload']['parts'])
-    else:
-        # Single part message
-        print("  📄 Single-part message (no attachments)")
+    if 'parts' not in message['payload']:
+        # Single part message (no attachments)
+        return attachments
+    
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for part, depth in iter_parts(message['payload']['parts']):
+        filename = part.get('filename', '')
+        body = part.get('body', {})
+        attachment_id = body.get('attachmentId')
+        
+        # An attachment either has a filename or an attachmentId with reasonable size
+        if filename and attachment_id:
+            attachments.append({
+                'filename': filename,
+                'mime_type': part.get('mimeType', ''),
+                'size': body.get('size', 0),
+                'attachment_id': attachment_id,
+                'part_id': part.get('partId', ''),
+            })
+        
+        if debug:
+            logger.debug(
+                "%sPart %s: %s, filename=%r, attachment_id=%s",
+                "  " * depth, part.get('partId'), part.get('mimeType', ''), filename, bool(attachment_id),
+            )
     
     return attachments
 
@@ -601,17 +819,19 @@ def extract_attachments_info(message):
 async def resync_email(email: str, message_id: str, session: AsyncSession = Depends(get_async_session)):
     """Re-fetch and update an email from Gmail (useful for fixing missing data)"""
     
-    res_user = await session.execute(select(GmailUser).where(GmailUser.email == email))
+    res_user = await session.execute(select(GmailUser).where(GmailUser.email == email).options(GMAIL_SERVICE_FIELDS))
     user = res_user.scalar_one_or_none()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     try:
-        credentials = dict_to_credentials(user.credentials)
-        service = build('gmail', 'v1', credentials=credentials)
+        service = await get_gmail_service(user)
         
         # Fetch the email again
         await fetch_and_store_email(service, email, message_id, session)
+        await session.commit()
+        await flush_email_events(session)
+        invalidate_user_caches(email)
         
         return {"status": "success", "message": f"Email {message_id} re-synced"}
         
@@ -619,22 +839,114 @@ async def resync_email(email: str, message_id: str, session: AsyncSession = Depe
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def ensure_user_exists(session: AsyncSession, email: str):
+    """404 for unknown users; read endpoints call it only when their result is empty"""
+    user_id = (await session.execute(select(GmailUser.id).where(GmailUser.email == email))).scalar_one_or_none()
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+
+# Columns returned by the listing/search endpoints; the rest of the row (bodies, labels, attachments) is never read
+EMAIL_LISTING_COLUMNS = (
+    GmailEmail.id,
+    GmailEmail.user_email,
+    GmailEmail.message_id,
+    GmailEmail.subject,
+    GmailEmail.from_addr,
+    GmailEmail.to_addr,
+    GmailEmail.snippet,
+    GmailEmail.internal_date,
+    GmailEmail.has_attachments,
+    GmailEmail.received_at,
+)
+
+
+def email_listing_dict(r) -> dict:
+    """Response shape of one EMAIL_LISTING_COLUMNS row"""
+    return {
+        "user_email": r.user_email,
+        "message_id": r.message_id,
+        "subject": r.subject,
+        "from": r.from_addr,
+        "to": r.to_addr,
+        "snippet": r.snippet,
+        "internal_date": r.internal_date,
+        "has_attachments": r.has_attachments,
+        "received_at": r.received_at,
+    }
+
+
+# Bounds on client-supplied paging; deeper pages should follow next_cursor instead of skip
+EMAIL_PAGE_MAX = 100
+EMAIL_SKIP_MAX = 10_000
+
+# Shorter queries are mostly partial words, which full-text search would not match
+SEARCH_MIN_TEXT_LENGTH = 3
+
+
+def escape_like(value: str) -> str:
+    """Escape LIKE wildcards so user input matches literally (used with escape='\\')"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+# Declared before /user/emails/{message_id}, which would otherwise capture "search" as a message id
+@app.get("/user/emails/search")
+async def search_emails(
+    email: str,
+    query: str,
+    limit: int = Query(20, ge=1, le=EMAIL_PAGE_MAX),
+    mode: Literal["text", "contains"] = "text",
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Search user's emails by subject or sender.
+    mode=text (default) uses the full-text index, best matches first; queries shorter than
+    SEARCH_MIN_TEXT_LENGTH match as a case-insensitive prefix instead.
+    mode=contains is a substring match (slower: no index can serve it).
+    """
+    
+    stmt = select(*EMAIL_LISTING_COLUMNS).where(GmailEmail.user_email == email)
+    if mode == "text" and len(query.strip()) >= SEARCH_MIN_TEXT_LENGTH:
+        vector = email_search_vector(GmailEmail.subject, GmailEmail.from_addr)
+        ts_query = func.websearch_to_tsquery(literal_column("'simple'"), query)
+        stmt = stmt.where(vector.op("@@")(ts_query)).order_by(
+            func.ts_rank(vector, ts_query).desc(),
+            GmailEmail.internal_date.desc().nullslast(),
+        )
+    elif mode == "text":
+        # Short query: anchored prefix match on lower(), served by the text_pattern_ops indexes
+        q = f"{escape_like(query.lower())}%"
+        stmt = stmt.where(
+            func.lower(GmailEmail.subject).like(q, escape="\\") | func.lower(GmailEmail.from_addr).like(q, escape="\\"),
+        ).order_by(GmailEmail.internal_date.desc().nullslast())
+    else:
+        # Opt-in substring match: cannot use an index, scans the user's emails
+        q = f"%{escape_like(query)}%"
+        stmt = stmt.where(
+            GmailEmail.subject.ilike(q, escape="\\") | GmailEmail.from_addr.ilike(q, escape="\\"),
+        ).order_by(GmailEmail.internal_date.desc().nullslast())
+    res_emails = await session.execute(stmt.limit(limit))
+    emails_rows = res_emails.all()
+    if not emails_rows:
+        await ensure_user_exists(session, email)
+    emails = [email_listing_dict(r) for r in emails_rows]
+    return {"emails": emails, "query": query}
+
+
 # New endpoint to get a single email with full content
 @app.get("/user/emails/{message_id}")
 async def get_email_details(email: str, message_id: str, session: AsyncSession = Depends(get_async_session)):
     """Get full details of a specific email including body and attachments"""
     
-    res_user = await session.execute(select(GmailUser).where(GmailUser.email == email))
-    user = res_user.scalar_one_or_none()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     res_email = await session.execute(
-        select(GmailEmail).where(GmailEmail.user_email == email, GmailEmail.message_id == message_id)
+        select(GmailEmail)
+        .where(GmailEmail.user_email == email, GmailEmail.message_id == message_id)
+        .options(undefer(GmailEmail.body_plain), undefer(GmailEmail.body_html))
     )
     email_doc = res_email.scalar_one_or_none()
     
     if not email_doc:
+        await ensure_user_exists(session, email)
         raise HTTPException(status_code=404, detail="Email not found")
     
     return {
@@ -648,7 +960,7 @@ async def get_email_details(email: str, message_id: str, session: AsyncSession =
         "snippet": email_doc.snippet,
         "labels": email_doc.labels,
         "internal_date": email_doc.internal_date,
-        "received_at": email_doc.received_at.isoformat() if email_doc.received_at else None,
+        "received_at": email_doc.received_at,
         "body_plain": email_doc.body_plain,
         "body_html": email_doc.body_html,
         "body_snippet": email_doc.body_snippet,
@@ -661,6 +973,20 @@ async def get_email_details(email: str, message_id: str, session: AsyncSession =
     }
 
 
+# Concurrent /extract-data calls per invoice email (each is a full Gemini extraction)
+AUTO_EXTRACT_CONCURRENCY = int(os.getenv("AUTO_EXTRACT_CONCURRENCY", "4"))
+
+
+# Base64 characters decoded per streamed chunk (a multiple of 4, ~48KB of output)
+ATTACHMENT_CHUNK_CHARS = 64 * 1024
+
+
+def iter_base64_chunks(data: str):
+    """Yield decoded bytes of a urlsafe base64 string in fixed-size chunks"""
+    for start in range(0, len(data), ATTACHMENT_CHUNK_CHARS):
+        yield base64.urlsafe_b64decode(data[start:start + ATTACHMENT_CHUNK_CHARS])
+
+
 # New endpoint to download attachment
 @app.get("/user/emails/{message_id}/attachments/{attachment_filename}")
 async def download_attachment(
@@ -671,111 +997,96 @@ async def download_attachment(
 ):
     """Download a specific attachment from an email by filename"""
     
-    print(f"🔍 Download request - message_id: {message_id}, filename: {attachment_filename}")
+    logger.debug("Download request - message_id: %s, filename: %s", message_id, attachment_filename)
+    
+    # Stored attachment metadata (from extract_attachments_info) carries the attachment_id
+    query = select(GmailEmail.user_email, GmailEmail.attachments).where(GmailEmail.message_id == message_id)
+    if email:
+        query = query.where(GmailEmail.user_email == email)
+    email_row = (await session.execute(query)).first()
     
     # If email not provided as query param, find it from the message
     if not email:
-        res_email = await session.execute(select(GmailEmail).where(GmailEmail.message_id == message_id))
-        email_doc = res_email.scalar_one_or_none()
-        if not email_doc:
-            print(f"❌ Email document not found for message_id: {message_id}")
+        if not email_row:
+            logger.warning("Email document not found for message_id: %s", message_id)
             raise HTTPException(status_code=404, detail="Email not found")
-        email = email_doc.user_email
-        print(f"✅ Found user email: {email}")
+        email = email_row.user_email
+        logger.debug("Found user email: %s", email)
     
-    res_user = await session.execute(select(GmailUser).where(GmailUser.email == email))
+    res_user = await session.execute(select(GmailUser).where(GmailUser.email == email).options(GMAIL_SERVICE_FIELDS))
     user = res_user.scalar_one_or_none()
     if not user:
-        print(f"❌ User not found: {email}")
+        logger.warning("User not found: %s", email)
         raise HTTPException(status_code=404, detail="User not found")
     
     try:
-        credentials = dict_to_credentials(user.credentials)
-        service = build('gmail', 'v1', credentials=credentials)
-        
-        # Fetch the full message again to get attachment IDs
-        print(f"📥 Fetching message from Gmail API...")
-        message = service.users().messages().get(
-            userId='me',
-            id=message_id,
-            format='full'
-        ).execute()
+        service = await get_gmail_service(user)
         
-        # Find the attachment with matching filename
-        def find_attachment_id(parts, target_filename):
-            """Recursively search for attachment by filename"""
-            for part in parts:
-                if 'parts' in part:
-                    result = find_attachment_id(part['parts'], target_filename)
-                    if result:
-                        return result
-                
-                filename = part.get('filename', '')
-                if filename == target_filename:
-                    attachment_id = part.get('body', {}).get('attachmentId')
-                    if attachment_id:
-                        return {
-                            'attachment_id': attachment_id,
-                            'mime_type': part.get('mimeType', 'application/octet-stream'),
-                            'size': part.get('body', {}).get('size', 0)
-                        }
-            return None
-        
-        attachment_info = None
-        if 'parts' in message['payload']:
-            attachment_info = find_attachment_id(message['payload']['parts'], attachment_filename)
+        stored_attachments = (email_row.attachments if email_row else None) or []
+        attachment_info = next(
+            (att for att in stored_attachments if att.get('filename') == attachment_filename and att.get('attachment_id')),
+            None,
+        )
+        if attachment_info is None:
+            # Not in the stored metadata (older rows, or no attachment_id): fetch the message to find it
+            logger.debug("No stored attachment metadata for %s, fetching message from Gmail API", message_id)
+            message = await run_gmail(email, service.users().messages().get(
+                userId='me',
+                id=message_id,
+                format='full',
+                fields=GMAIL_MESSAGE_FIELDS,
+            ).execute)
+            attachment_info = next(
+                (att for att in extract_attachments_info(message) if att['filename'] == attachment_filename),
+                None,
+            )
         
         if not attachment_info:
-            print(f"❌ Attachment '{attachment_filename}' not found in message")
+            logger.warning("Attachment '%s' not found in message %s", attachment_filename, message_id)
             raise HTTPException(status_code=404, detail=f"Attachment '{attachment_filename}' not found")
         
-        print(f"✅ Found attachment: {attachment_filename}")
-        print(f"   - attachment_id: {attachment_info['attachment_id'][:50]}...")
-        print(f"   - mime_type: {attachment_info['mime_type']}")
-        print(f"   - size: {attachment_info['size']} bytes")
+        mime_type = attachment_info.get('mime_type') or 'application/octet-stream'
+        
+        logger.debug(
+            "Found attachment %s (attachment_id %.50s..., mime_type %s, %s bytes)",
+            attachment_filename, attachment_info['attachment_id'], mime_type, attachment_info['size'],
+        )
         
         # Download the attachment
-        attachment = service.users().messages().attachments().get(
+        attachment = await run_gmail(email, service.users().messages().attachments().get(
             userId='me',
             messageId=message_id,
             id=attachment_info['attachment_id']
-        ).execute()
+        ).execute)
         
-        # Decode the attachment data
-        file_data = base64.urlsafe_b64decode(attachment['data'])
-        print(f"✅ Downloaded {len(file_data)} bytes")
+        logger.debug("Downloaded attachment %s (%s bytes)", attachment_filename, attachment.get('size', 0))
         
-        # Return the file
-        return Response(
-            content=file_data,
-            media_type=attachment_info['mime_type'],
+        # Stream the file, decoding the base64 payload chunk by chunk
+        return StreamingResponse(
+            iter_base64_chunks(attachment['data']),
+            media_type=mime_type,
             headers={
                 'Content-Disposition': f'attachment; filename="{attachment_filename}"'
             }
         )
         
     except HttpError as error:
-        print(f"❌ Gmail API error: {error}")
+        logger.error("Gmail API error downloading %s from %s: %s", attachment_filename, message_id, error)
         raise HTTPException(status_code=500, detail=str(error))
 
 
 def extract_email_info(message):
     """Extract relevant information from Gmail message"""
-    headers = message['payload']['headers']
-    
-    def get_header(name):
-        for header in headers:
-            if header['name'].lower() == name.lower():
-                return header['value']
-        return None
+    # Case-folded header lookup; built in reverse so the first occurrence of a repeated header wins
+    headers = {header['name'].lower(): header['value'] for header in reversed(message['payload']['headers'])}
     
     return {
         'message_id': message['id'],
         'thread_id': message['threadId'],
-        'from': get_header('From'),
-        'to': get_header('To'),
-        'subject': get_header('Subject'),
-        'date': get_header('Date'),
+        'from': headers.get('from'),
+        'to': headers.get('to'),
+        'subject': headers.get('subject'),
+        'date': headers.get('date'),
         'snippet': message.get('snippet', ''),
         'labels': message.get('labelIds', []),
         'internal_date': int(message.get('internalDate', 0)),
@@ -783,49 +1094,249 @@ def extract_email_info(message):
     }
 
 
+def email_row_values(email_info: dict) -> dict:
+    """Map extracted email_info onto GmailEmail column values"""
+    return {
+        'user_email': email_info.get('user_email'),
+        'message_id': email_info.get('message_id'),
+        'thread_id': email_info.get('thread_id'),
+        'from_addr': email_info.get('from'),
+        'to_addr': email_info.get('to'),
+        'subject': email_info.get('subject'),
+        'date': email_info.get('date'),
+        'snippet': email_info.get('snippet'),
+        'labels': email_info.get('labels') or [],
+        'internal_date': str(email_info.get('internal_date') or ''),
+        'received_at': email_info.get('received_at') or datetime.utcnow(),
+        'body_plain': email_info.get('body_plain'),
+        'body_html': email_info.get('body_html'),
+        'body_snippet': email_info.get('body_snippet'),
+        'has_attachments': email_info.get('has_attachments', False),
+        'attachments': email_info.get('attachments') or [],
+        'priority': email_info.get('priority'),
+        'is_important': email_info.get('is_important', False),
+        'category': email_info.get('category'),
+        'sender_domain': email_info.get('sender_domain'),
+    }
+
+
+# Subject keyword rules, each a single case-insensitive scan
+IMPORTANT_RE = re.compile(r"urgent|important|asap|critical", re.IGNORECASE)
+# Word-start anchored so "sales"/"deals"/"coupons" match but "wholesale"/"idealize" do not
+PROMO_RE = re.compile(r"\b(?:sale|discount|offer|deal|promo|coupon)", re.IGNORECASE)
+
+
+def enrich_email_info(email_info: dict) -> dict:
+    """Set the derived priority, is_important, sender_domain and category fields on email_info"""
+    subject = email_info.get('subject') or ''
+    
+    # Mark as important based on keywords
+    if IMPORTANT_RE.search(subject):
+        email_info['priority'] = "high"
+        email_info['is_important'] = True
+    
+    # Categorize by sender domain ("Name <user@host>" and bare addresses alike)
+    _, address = parseaddr(email_info.get('from') or '')
+    if '@' in address:
+        email_info['sender_domain'] = address.rpartition('@')[2].lower() or None
+    
+    # Auto-tag promotional emails
+    if PROMO_RE.search(subject):
+        email_info['category'] = "promotional"
+    
+    return email_info
+
+
+def user_email_count_values(user_email: str) -> dict:
+    """GmailUserStat counter columns computed from the user's stored emails (one subquery per count)"""
+    # Each count is its own subquery so it can use its (partial) index
+    def count_where(*conditions):
+        return select(func.count()).where(GmailEmail.user_email == user_email, *conditions).scalar_subquery()
+    
+    return {
+        "total_emails": count_where(),
+        "important_emails": count_where(GmailEmail.is_important.is_(True)),
+        "attachment_emails": count_where(GmailEmail.has_attachments.is_(True)),
+    }
+
+
+async def seed_user_stats(session: AsyncSession, user_email: str) -> bool:
+    """
+    Create the user's GmailUserStat row from a full count of their emails (including rows
+    staged in this transaction). Returns False if another transaction created it first.
+    """
+    res = await session.execute(
+        pg_insert(GmailUserStat)
+        .values(user_email=user_email, updated_at=datetime.utcnow(), **user_email_count_values(user_email))
+        .on_conflict_do_nothing(index_elements=[GmailUserStat.user_email])
+        .returning(GmailUserStat.id)
+    )
+    return res.scalar_one_or_none() is not None
+
+
+async def bump_user_stats(session: AsyncSession, user_email: str, total: int, important: int, attachment: int):
+    """
+    Add newly stored emails (already staged in the session) to the user's GmailUserStat counters.
+    A missing row is seeded from a full count, which already includes the new emails, so
+    mailboxes stored before the counters existed start from correct numbers.
+    """
+    bump = (
+        update(GmailUserStat)
+        .where(GmailUserStat.user_email == user_email)
+        .values(
+            total_emails=GmailUserStat.total_emails + total,
+            important_emails=GmailUserStat.important_emails + important,
+            attachment_emails=GmailUserStat.attachment_emails + attachment,
+            updated_at=datetime.utcnow(),
+        )
+        .returning(GmailUserStat.id)
+    )
+    if (await session.execute(bump)).scalar_one_or_none() is not None:
+        return
+    if await seed_user_stats(session, user_email):
+        return
+    # Created concurrently by a transaction that could not see our uncommitted emails: add them
+    await session.execute(bump)
+
+
+async def get_user_email_counts(session: AsyncSession, user_email: str) -> GmailUserStat:
+    """
+    Return the user's email counters. Users without a counter row yet (mail stored before
+    the counters existed) get one built from a single count over their emails.
+    """
+    stats = (
+        await session.execute(select(GmailUserStat).where(GmailUserStat.user_email == user_email))
+    ).scalar_one_or_none()
+    if stats is not None:
+        return stats
+    
+    # No counters yet: only build them for a real user
+    await ensure_user_exists(session, user_email)
+    
+    await seed_user_stats(session, user_email)
+    await session.commit()
+    return (
+        await session.execute(select(GmailUserStat).where(GmailUserStat.user_email == user_email))
+    ).scalar_one()
+
+
+# RETURNING expression of an upsert: true when the row was inserted, false when it was updated
+EMAIL_ROW_INSERTED = literal_column("xmax = 0")
+
+
 async def store_email(email_info: dict, session: AsyncSession):
-    """Store email in Postgres"""
+    """Stage an email insert/update in the session; the caller commits"""
     try:
-        res = await session.execute(select(GmailEmail).where(GmailEmail.message_id == email_info['message_id']))
-        row = res.scalar_one_or_none()
-        if not row:
-            row = GmailEmail(
-                user_email=email_info.get('user_email'),
-                message_id=email_info.get('message_id'),
-                thread_id=email_info.get('thread_id'),
-                from_addr=email_info.get('from'),
-                to_addr=email_info.get('to'),
-                subject=email_info.get('subject'),
-                date=email_info.get('date'),
-                snippet=email_info.get('snippet'),
-                labels=email_info.get('labels') or [],
-                internal_date=str(email_info.get('internal_date') or ''),
-                body_plain=email_info.get('body_plain'),
-                body_html=email_info.get('body_html'),
-                body_snippet=email_info.get('body_snippet'),
-                has_attachments=email_info.get('has_attachments', False),
-                attachments=email_info.get('attachments') or [],
+        values = email_row_values(email_info)
+        # One upsert: already stored messages (resync, duplicate notification) are updated in place,
+        # keeping their original received_at
+        stmt = pg_insert(GmailEmail).values(**values)
+        res = await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[GmailEmail.message_id],
+                set_={key: stmt.excluded[key] for key in values if key not in ('message_id', 'received_at')},
             )
-            session.add(row)
-        else:
-            row.user_email = email_info.get('user_email')
-            row.thread_id = email_info.get('thread_id')
-            row.from_addr = email_info.get('from')
-            row.to_addr = email_info.get('to')
-            row.subject = email_info.get('subject')
-            row.date = email_info.get('date')
-            row.snippet = email_info.get('snippet')
-            row.labels = email_info.get('labels') or []
-            row.internal_date = str(email_info.get('internal_date') or '')
-            row.body_plain = email_info.get('body_plain')
-            row.body_html = email_info.get('body_html')
-            row.body_snippet = email_info.get('body_snippet')
-            row.has_attachments = email_info.get('has_attachments', False)
-            row.attachments = email_info.get('attachments') or []
-        await session.commit()
-        print(f"Stored email: {email_info['subject']}")
-    except Exception as e:
-        print(f"Error storing email: {e}")
+            .returning(EMAIL_ROW_INSERTED)
+        )
+        if res.scalar_one():
+            await bump_user_stats(
+                session, values['user_email'], 1, int(bool(values['is_important'])), int(bool(values['has_attachments'])),
+            )
+        logger.debug("Stored email: %s", email_info['message_id'])
+    except Exception:
+        logger.exception("Error storing email %s", email_info.get('message_id'))
+
+
+# Rows per multi-row upsert; ~20 bind parameters per row stays well under Postgres' 32767 limit
+EMAIL_BULK_CHUNK = 500
+
+
+async def store_emails_bulk(email_infos: list, session: AsyncSession):
+    """
+    Stage a batch of emails (distinct message_ids, one user) with multi-row upserts; the caller commits.
+    Counters are bumped once for all newly inserted rows.
+    """
+    if not email_infos:
+        return
+    rows = [email_row_values(email_info) for email_info in email_infos]
+    inserted_ids = set()
+    for start in range(0, len(rows), EMAIL_BULK_CHUNK):
+        stmt = pg_insert(GmailEmail).values(rows[start:start + EMAIL_BULK_CHUNK])
+        res = await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[GmailEmail.message_id],
+                set_={key: stmt.excluded[key] for key in rows[0] if key not in ('message_id', 'received_at')},
+            )
+            .returning(GmailEmail.message_id, EMAIL_ROW_INSERTED)
+        )
+        inserted_ids.update(message_id for message_id, inserted in res.all() if inserted)
+    
+    inserted = [row for row in rows if row['message_id'] in inserted_ids]
+    if inserted:
+        await bump_user_stats(
+            session,
+            rows[0]['user_email'],
+            len(inserted),
+            sum(1 for row in inserted if row['is_important']),
+            sum(1 for row in inserted if row['has_attachments']),
+        )
+    logger.info("Stored %d email(s) (%d new) for %s", len(rows), len(inserted), rows[0]['user_email'])
+
+
+# Email events are written off the request path: sessions hand them to this queue after
+# committing, and email_event_flusher inserts them in batches of up to EMAIL_EVENT_BATCH_SIZE
+EMAIL_EVENT_QUEUE_SIZE = 10_000
+EMAIL_EVENT_BATCH_SIZE = 500
+EMAIL_EVENT_DRAIN_SECONDS = 10
+_email_event_queue: asyncio.Queue = asyncio.Queue(maxsize=EMAIL_EVENT_QUEUE_SIZE)
+_email_event_task = None
+
+
+def queue_email_event(session: AsyncSession, **event):
+    """Collect an EmailEvent row on the session; flush_email_events hands them to the writer"""
+    session.info.setdefault('pending_email_events', []).append(event)
+
+
+async def flush_email_events(session: AsyncSession):
+    """
+    Pass the events collected on the session to the background writer (call after commit,
+    so events of a rolled-back batch are never written). If the queue is full they are
+    inserted inline instead of being dropped.
+    """
+    events = session.info.pop('pending_email_events', None)
+    overflow = []
+    for event in events or ():
+        try:
+            _email_event_queue.put_nowait(event)
+        except asyncio.QueueFull:
+            overflow.append(event)
+    if overflow:
+        logger.warning("Email event queue full, writing %d events inline", len(overflow))
+        await write_email_events(overflow)
+
+
+async def write_email_events(events: list):
+    """Insert a batch of EmailEvent rows with one multi-row INSERT in its own session"""
+    try:
+        async with async_session_maker() as session:
+            await session.execute(insert(EmailEvent), events)
+            await session.commit()
+    except Exception:
+        logger.exception("Failed to write %d email events", len(events))
+
+
+async def email_event_flusher():
+    """Drain the event queue until cancelled, writing whatever has accumulated in one INSERT"""
+    while True:
+        batch = [await _email_event_queue.get()]
+        while len(batch) < EMAIL_EVENT_BATCH_SIZE:
+            try:
+                batch.append(_email_event_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        await write_email_events(batch)
+        for _ in batch:
+            _email_event_queue.task_done()
 
 
 async def handle_new_email(user_email: str, email_info: dict, full_message: dict, session: AsyncSession):
@@ -833,7 +1344,7 @@ async def handle_new_email(user_email: str, email_info: dict, full_message: dict
     CUSTOM EMAIL HANDLER - Implement your business logic here
     
     This function is called whenever a new email is received.
-    The email has already been stored in MongoDB at this point.
+    The email row is already staged in the session; the caller commits the batch.
     
     Args:
         user_email: Email address of the user who received the email
@@ -863,21 +1374,13 @@ async def handle_new_email(user_email: str, email_info: dict, full_message: dict
     Example implementation below:
     """
     
-    # Example 1: Check for high-priority emails
-    subject = email_info.get('subject', '').lower()
-    sender = email_info.get('from', '').lower()
+    # Derived fields (priority, sender_domain, category) were set by enrich_email_info
+    # and written with the email row in store_email
+    subject = (email_info.get('subject') or '').lower()
     
-    # Mark as important based on keywords
-    is_important = any(keyword in subject for keyword in ['urgent', 'important', 'asap', 'critical'])
-    
-    if is_important:
-        res_email = await session.execute(select(GmailEmail).where(GmailEmail.message_id == email_info['message_id']))
-        row = res_email.scalar_one_or_none()
-        if row:
-            row.priority = "high"
-            row.is_important = True
-            await session.commit()
-        print(f"⚠️  High priority email detected: {email_info['subject']}")
+    # Example 1: Check for high-priority emails
+    if email_info.get('is_important'):
+        logger.info("High priority email detected: %s", email_info['message_id'])
         
         # TODO: Send push notification to user
         # await send_push_notification(user_email, {
@@ -885,90 +1388,79 @@ async def handle_new_email(user_email: str, email_info: dict, full_message: dict
         #     "body": f"From: {email_info['from']}\nSubject: {email_info['subject']}"
         # })
     
-    # Example 2: Categorize by sender domain
-    if '@' in sender:
-        domain = sender.split('@')[1].split('>')[0]
-        res_email = await session.execute(select(GmailEmail).where(GmailEmail.message_id == email_info['message_id']))
-        row = res_email.scalar_one_or_none()
-        if row:
-            row.sender_domain = domain
-        # Track sender statistics
-        res_stat = await session.execute(
-            select(GmailSenderStat).where(GmailSenderStat.user_email == user_email, GmailSenderStat.domain == domain)
+    # Example 2: Track sender statistics (one upsert on uq_user_domain)
+    domain = email_info.get('sender_domain')
+    if domain:
+        now = datetime.utcnow()
+        await session.execute(
+            pg_insert(GmailSenderStat)
+            .values(user_email=user_email, domain=domain, email_count=1, last_email_date=now)
+            .on_conflict_do_update(
+                constraint="uq_user_domain",
+                set_={
+                    "email_count": func.coalesce(GmailSenderStat.email_count, 0) + 1,
+                    "last_email_date": now,
+                },
+            )
         )
-        stat = res_stat.scalar_one_or_none()
-        if not stat:
-            stat = GmailSenderStat(user_email=user_email, domain=domain, email_count=1, last_email_date=datetime.utcnow())
-            session.add(stat)
-        else:
-            stat.email_count = (stat.email_count or 0) + 1
-            stat.last_email_date = datetime.utcnow()
-        await session.commit()
     
-# Example 3: Extract and store attachments info
-    # Reuse the recursive extractor to find all attachments and then filter images
-    image_attachments = []
-    attachments = extract_attachments_info(full_message)
-    if attachments:
-        res_email = await session.execute(select(GmailEmail).where(GmailEmail.message_id == email_info['message_id']))
-        row = res_email.scalar_one_or_none()
-        if row:
-            row.attachments = attachments
-            row.has_attachments = True
-            await session.commit()
-        print(f"📎 Email has {len(attachments)} attachment(s)")
-        image_attachments = [a for a in attachments if str(a.get('mime_type','')).startswith('image/')]
+    # Example 3: Attachments were extracted and stored with the email; filter images
+    attachments = email_info.get('attachments') or []
+    image_attachments = [a for a in attachments if str(a.get('mime_type','')).startswith('image/')]
     
     # Auto-trigger extraction: subject contains 'invoice' and has image attachment(s)
     try:
         if 'invoice' in subject and image_attachments:
             from urllib.parse import quote
             message_id = email_info.get('message_id')
-            print(f"🧾 Invoice email detected with {len(image_attachments)} image attachment(s). Triggering extraction...")
+            logger.info(
+                "Invoice email %s has %d image attachment(s), triggering extraction", message_id, len(image_attachments),
+            )
+            # /extract-data downloads the attachment in its own session, so the
+            # email row must be committed before it is called
+            await session.commit()
+            await flush_email_events(session)
             # Generate a short-lived JWT so /extract-data can attribute created_by
             # Note: Using same user_info stored on GmailUser
-            res_user = await session.execute(select(GmailUser).where(GmailUser.email == user_email))
-            user_row = res_user.scalar_one_or_none()
-            user_info = user_row.user_info if user_row else {"email": user_email}
+            res_user = await session.execute(select(GmailUser.user_info).where(GmailUser.email == user_email))
+            user_info = res_user.scalar_one_or_none() or {"email": user_email}
             access_token = create_access_token(user_email, user_info)
 
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                for att in image_attachments:
-                    encoded_filename = quote(att['filename'])
-                    attachment_url = f"{BASE_URL}/user/emails/{message_id}/attachments/{encoded_filename}"
-                    payload = {
-                        "attachment_url": attachment_url
-                    }
-                    headers = {"Authorization": f"Bearer {access_token}"}
-                    try:
+            headers = {"Authorization": f"Bearer {access_token}"}
+            slots = asyncio.Semaphore(AUTO_EXTRACT_CONCURRENCY)
+
+            async def extract_attachment(client, att):
+                encoded_filename = quote(att['filename'])
+                attachment_url = f"{BASE_URL}/user/emails/{message_id}/attachments/{encoded_filename}"
+                payload = {
+                    "attachment_url": attachment_url
+                }
+                try:
+                    async with slots:
                         resp = await client.post(f"{BASE_URL}/extract-data", json=payload, headers=headers)
-                        if resp.status_code == 200:
-                            print(f"✅ Extracted document from attachment '{att['filename']}'")
-                        else:
-                            print(f"❌ Extraction failed for '{att['filename']}': {resp.status_code} {resp.text}")
-                    except Exception as e:
-                        print(f"❌ HTTP error calling /extract-data for '{att['filename']}': {e}")
-    except Exception as e:
-        print(f"❌ Auto-extract pipeline error: {e}")
-    
-    # Example 4: Auto-tag promotional emails
-    if any(keyword in subject for keyword in ['sale', 'discount', 'offer', 'deal']):
-        res_email = await session.execute(select(GmailEmail).where(GmailEmail.message_id == email_info['message_id']))
-        row = res_email.scalar_one_or_none()
-        if row:
-            row.category = "promotional"
-            await session.commit()
+                    if resp.status_code == 200:
+                        logger.info("Extracted document from attachment '%s'", att['filename'])
+                    else:
+                        logger.error("Extraction failed for '%s': %s %s", att['filename'], resp.status_code, resp.text)
+                except Exception:
+                    logger.exception("HTTP error calling /extract-data for '%s'", att['filename'])
+
+            # Each extraction is a long Gemini round trip; run them side by side
+            async with httpx.AsyncClient(timeout=120.0) as client:
+                await asyncio.gather(*(extract_attachment(client, att) for att in image_attachments))
+    except Exception:
+        logger.exception("Auto-extract pipeline error")
     
-    # Example 5: Log email event for analytics
-    session.add(EmailEvent(
+    # Example 4: Log email event for analytics
+    queue_email_event(
+        session,
         user_email=user_email,
         event_type="email_received",
         message_id=email_info['message_id'],
         sender=email_info.get('from'),
         subject=email_info.get('subject'),
         timestamp=datetime.utcnow(),
-    ))
-    await session.commit()
+    )
     
     # TODO: Add your custom business logic here
     # - Send to AI for summarization
@@ -979,82 +1471,137 @@ async def handle_new_email(user_email: str, email_info: dict, full_message: dict
     # etc.
 
 
+# Largest exact total get_user_emails will count before reporting "<cap>+"
+EMAIL_TOTAL_CAP = 1000
+
+
 @app.get("/user/emails")
-async def get_user_emails(email: str, skip: int = 0, limit: int = 20, session: AsyncSession = Depends(get_async_session)):
-    """Fetch user's emails from Postgres with pagination"""
-    
-    res_user = await session.execute(select(GmailUser).where(GmailUser.email == email))
-    user = res_user.scalar_one_or_none()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    res_emails = await session.execute(
-        select(GmailEmail)
-        .where(GmailEmail.user_email == email)
-        .order_by(GmailEmail.internal_date.desc().nullslast())
-        .offset(skip)
-        .limit(limit)
-    )
-    emails_rows = res_emails.scalars().all()
-    emails = [
-        {
-            "user_email": r.user_email,
-            "message_id": r.message_id,
-            "subject": r.subject,
-            "from": r.from_addr,
-            "to": r.to_addr,
-            "snippet": r.snippet,
-            "internal_date": r.internal_date,
-            "has_attachments": r.has_attachments,
-            "received_at": r.received_at.isoformat() if r.received_at else None,
-        }
-        for r in emails_rows
-    ]
-    total = len(
-        (
-            await session.execute(
-                select(GmailEmail).where(GmailEmail.user_email == email)
-            )
-        ).scalars().all()
-    )
-    return {"emails": emails, "total": total, "skip": skip, "limit": limit}
+async def get_user_emails(
+    email: str,
+    before_date: Optional[str] = None,
+    before_id: Optional[int] = None,
+    skip: int = Query(0, ge=0, le=EMAIL_SKIP_MAX),
+    limit: int = Query(20, ge=1, le=EMAIL_PAGE_MAX),
+    include_total: bool = False,
+    stream: bool = False,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Fetch user's emails from Postgres with pagination.
+    Pass the previous page's next_cursor (before_date, before_id; both or neither) to continue
+    after it; skip is kept for offset paging but costs O(skip) on deep pages.
+    The total is only counted when include_total is set (capped at EMAIL_TOTAL_CAP).
+    stream=true returns the same JSON, written row by row from a server-side cursor.
+    """
+    if (before_date is None) != (before_id is None):
+        raise HTTPException(status_code=422, detail="before_date and before_id must be passed together")
+    
+    # Count at most EMAIL_TOTAL_CAP + 1 index entries; larger mailboxes report "<cap>+"
+    capped = select(GmailEmail.id).where(GmailEmail.user_email == email).limit(EMAIL_TOTAL_CAP + 1).subquery()
+    total_query = select(func.count()).select_from(capped)
+    
+    query = select(*EMAIL_LISTING_COLUMNS).where(GmailEmail.user_email == email)
+    if include_total:
+        # Fetched alongside the page in the same statement instead of a second round trip
+        query = query.add_columns(total_query.scalar_subquery().label("total"))
+    # NULL dates sort as '' (last), so undated rows are still reachable through the cursor
+    sort_date = email_sort_date(GmailEmail.internal_date)
+    if before_id is not None:
+        # Keyset: rows strictly after the cursor in (sort_date DESC, id DESC) order
+        query = query.where(tuple_(sort_date, GmailEmail.id) < tuple_(before_date, before_id))
+    else:
+        query = query.offset(skip)
+    query = query.order_by(sort_date.desc(), GmailEmail.id.desc()).limit(limit)
+    if stream:
+        return await stream_user_emails(session, email, query, total_query if include_total else None, skip, limit)
+    res_emails = await session.execute(query)
+    emails_rows = res_emails.all()
+    if not emails_rows:
+        await ensure_user_exists(session, email)
+    emails = [email_listing_dict(r) for r in emails_rows]
+    total = None
+    if include_total:
+        if emails_rows:
+            total = emails_rows[0].total
+        else:
+            # Empty page (past the end): no row carried the total, count on its own
+            total = (await session.execute(total_query)).scalar_one()
+        if total > EMAIL_TOTAL_CAP:
+            total = f"{EMAIL_TOTAL_CAP}+"
+    next_cursor = None
+    if len(emails_rows) == limit:
+        last = emails_rows[-1]
+        next_cursor = {"before_date": last.internal_date or "", "before_id": last.id}
+    return {
+        "emails": emails,
+        "total": total,
+        "has_more": len(emails_rows) == limit,
+        "skip": skip,
+        "limit": limit,
+        "next_cursor": next_cursor,
+    }
 
 
-@app.get("/user/emails/search")
-async def search_emails(email: str, query: str, limit: int = 20, session: AsyncSession = Depends(get_async_session)):
-    """Search user's emails by subject or sender"""
-    
-    res_user = await session.execute(select(GmailUser).where(GmailUser.email == email))
-    user = res_user.scalar_one_or_none()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    q = f"%{query}%"
-    res_emails = await session.execute(
-        select(GmailEmail)
-        .where(
-            GmailEmail.user_email == email,
-            (GmailEmail.subject.ilike(q)) | (GmailEmail.from_addr.ilike(q)),
-        )
-        .order_by(GmailEmail.internal_date.desc().nullslast())
-        .limit(limit)
-    )
-    emails_rows = res_emails.scalars().all()
-    emails = [
-        {
-            "user_email": r.user_email,
-            "message_id": r.message_id,
-            "subject": r.subject,
-            "from": r.from_addr,
-            "to": r.to_addr,
-            "snippet": r.snippet,
-            "internal_date": r.internal_date,
-            "has_attachments": r.has_attachments,
-            "received_at": r.received_at.isoformat() if r.received_at else None,
-        }
-        for r in emails_rows
-    ]
-    return {"emails": emails, "query": query}
+async def stream_user_emails(session: AsyncSession, email: str, query, total_query, skip: int, limit: int):
+    """
+    Stream a /user/emails page: each row is encoded and sent as the cursor yields it,
+    so large pages never sit in memory as a list of dicts.
+    The first row is read up front so an unknown user still gets a 404 instead of a cut-off body.
+    """
+    result = await session.stream(query)
+    first = await result.fetchone()
+    if first is None:
+        await result.close()
+        await ensure_user_exists(session, email)
+
+    async def generate():
+        count = 0
+        last = None
+        total = None
+        try:
+            yield b'{"emails":['
+            row = first
+            while row is not None:
+                if count:
+                    yield b","
+                yield orjson.dumps(email_listing_dict(row))
+                if total_query is not None and total is None:
+                    total = row.total
+                count += 1
+                last = row
+                row = await result.fetchone()
+        finally:
+            await result.close()
+        if total_query is not None:
+            if total is None:
+                total = (await session.execute(total_query)).scalar_one()
+            if total > EMAIL_TOTAL_CAP:
+                total = f"{EMAIL_TOTAL_CAP}+"
+        next_cursor = None
+        if count == limit:
+            next_cursor = {"before_date": last.internal_date or "", "before_id": last.id}
+        tail = orjson.dumps({
+            "total": total,
+            "has_more": count == limit,
+            "skip": skip,
+            "limit": limit,
+            "next_cursor": next_cursor,
+        })
+        # Splice the trailing fields into the open object: '],' + '"total":...}'
+        yield b"]," + tail[1:]
+
+    return StreamingResponse(generate(), media_type="application/json")
+
+
+# Dashboards poll these; short TTLs absorb the polling, and syncs/watch changes invalidate them
+_status_cache = TTLCache(maxsize=4096, ttl=10)
+_analytics_cache = TTLCache(maxsize=4096, ttl=60)
+
+
+def invalidate_user_caches(user_email: str):
+    """Drop the cached status/analytics for a user after their data changed"""
+    _status_cache.pop(user_email, None)
+    _analytics_cache.pop(user_email, None)
 
 
 @app.get("/auth/me")
@@ -1062,22 +1609,29 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user),
     """Get current authenticated user's information"""
     user_email = current_user["email"]
     
-    res_user = await session.execute(select(GmailUser).where(GmailUser.email == user_email))
+    res_user = await session.execute(
+        select(GmailUser)
+        .where(GmailUser.email == user_email)
+        .options(load_only(
+            GmailUser.email, GmailUser.user_info, GmailUser.last_login,
+            GmailUser.watch_expiration, GmailUser.last_sync,
+        ))
+    )
     user = res_user.scalar_one_or_none()
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    email_count = len((await session.execute(select(GmailEmail).where(GmailEmail.user_email == user_email))).scalars().all())
+    email_count = (await get_user_email_counts(session, user_email)).total_emails
     
     return {
         "authenticated": True,
         "email": user.email,
         "user_info": user.user_info,
-        "last_login": user.last_login.isoformat() if user.last_login else None,
+        "last_login": user.last_login,
         "watch_active": user.watch_expiration is not None,
-        "watch_expires": user.watch_expiration.isoformat() if user.watch_expiration else None,
-        "last_sync": user.last_sync.isoformat() if user.last_sync else None,
+        "watch_expires": user.watch_expiration,
+        "last_sync": user.last_sync,
         "email_count": email_count,
     }
 
@@ -1086,33 +1640,39 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user),
 async def get_user_status(email: str, session: AsyncSession = Depends(get_async_session)):
     """Check user's authentication and watch status (legacy endpoint - use /auth/me instead)"""
     
-    res_user = await session.execute(select(GmailUser).where(GmailUser.email == email))
-    user = res_user.scalar_one_or_none()
+    cached = _status_cache.get(email)
+    if cached is not None:
+        return cached
+    
+    res_user = await session.execute(
+        select(GmailUser.watch_expiration, GmailUser.last_sync).where(GmailUser.email == email)
+    )
+    user = res_user.one_or_none()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return {
+    status = {
         "email": email,
         "authenticated": True,
         "watch_active": user.watch_expiration is not None,
-        "watch_expires": user.watch_expiration.isoformat() if user.watch_expiration else None,
-        "last_sync": user.last_sync.isoformat() if user.last_sync else None,
-        "email_count": len((await session.execute(select(GmailEmail).where(GmailEmail.user_email == email))).scalars().all()),
+        "watch_expires": user.watch_expiration,
+        "last_sync": user.last_sync,
+        "email_count": (await get_user_email_counts(session, email)).total_emails,
     }
+    _status_cache[email] = status
+    return status
 
 
 @app.post("/user/refresh-watch")
 async def refresh_watch(email: str, session: AsyncSession = Depends(get_async_session)):
     """Manually refresh Gmail watch (call this before expiration)"""
     
-    res_user = await session.execute(select(GmailUser).where(GmailUser.email == email))
-    user = res_user.scalar_one_or_none()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     try:
+        # setup_gmail_watch loads the user itself and raises the 404
         await setup_gmail_watch(email, session)
         return {"status": "success", "message": "Watch refreshed"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1121,50 +1681,41 @@ async def refresh_watch(email: str, session: AsyncSession = Depends(get_async_se
 async def get_email_analytics(email: str, session: AsyncSession = Depends(get_async_session)):
     """Get email analytics for user"""
     
-    res_user = await session.execute(select(GmailUser).where(GmailUser.email == email))
-    user = res_user.scalar_one_or_none()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    cached = _analytics_cache.get(email)
+    if cached is not None:
+        return cached
     
-    # Total emails
-    total_emails = len((await session.execute(select(GmailEmail).where(GmailEmail.user_email == email))).scalars().all())
-
-    # Important emails
-    important_emails = await session.execute(
-        select(GmailEmail).where(GmailEmail.user_email == email, GmailEmail.is_important == True)
-    )
-    important_count = len(important_emails.scalars().all())
-
-    # Emails with attachments
-    emails_with_att = await session.execute(
-        select(GmailEmail).where(GmailEmail.user_email == email, GmailEmail.has_attachments == True)
-    )
-    attachment_count = len(emails_with_att.scalars().all())
+    # Total, important and with-attachment counts from the maintained counters
+    stats = await get_user_email_counts(session, email)
+    total_emails, important_count, attachment_count = stats.total_emails, stats.important_emails, stats.attachment_emails
 
     # Top senders
     res_senders = await session.execute(
-        select(GmailSenderStat)
+        # Only columns in ix_gmail_sender_stats_user_count, so Postgres can answer with an index-only scan
+        select(GmailSenderStat.domain, GmailSenderStat.email_count, GmailSenderStat.last_email_date)
         .where(GmailSenderStat.user_email == email)
         .order_by(GmailSenderStat.email_count.desc())
         .limit(10)
     )
-    top_senders_rows = res_senders.scalars().all()
+    top_senders_rows = res_senders.all()
     top_senders = [
         {
-            "user_email": s.user_email,
+            "user_email": email,
             "domain": s.domain,
             "email_count": s.email_count,
-            "last_email_date": s.last_email_date.isoformat() if s.last_email_date else None,
+            "last_email_date": s.last_email_date,
         }
         for s in top_senders_rows
     ]
     
-    return {
+    analytics = {
         "total_emails": total_emails,
         "important_emails": important_count,
         "emails_with_attachments": attachment_count,
         "top_senders": top_senders
     }
+    _analytics_cache[email] = analytics
+    return analytics
 
 
 @app.post("/auth/logout")
@@ -1172,12 +1723,15 @@ async def logout(current_user: dict = Depends(get_current_user), session: AsyncS
     """Logout current authenticated user"""
     user_email = current_user["email"]
     
-    res_user = await session.execute(select(GmailUser).where(GmailUser.email == user_email))
-    user = res_user.scalar_one_or_none()
-    if not user:
+    # Single UPDATE ... RETURNING: no row back means the user does not exist
+    res_user = await session.execute(
+        update(GmailUser)
+        .where(GmailUser.email == user_email)
+        .values(logged_out_at=datetime.utcnow())
+        .returning(GmailUser.id)
+    )
+    if res_user.scalar_one_or_none() is None:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    user.logged_out_at = datetime.utcnow()
     await session.commit()
     
     return {"status": "success", "message": "User logged out successfully"}
@@ -1187,15 +1741,18 @@ async def logout(current_user: dict = Depends(get_current_user), session: AsyncS
 async def logout_legacy(email: str, session: AsyncSession = Depends(get_async_session)):
     """Logout user (legacy endpoint - use POST /auth/logout instead)"""
     
-    res_user = await session.execute(select(GmailUser).where(GmailUser.email == email))
-    user = res_user.scalar_one_or_none()
-    if not user:
+    # Idempotent: re-logging out an already cleared user still matches the row and succeeds
+    res_user = await session.execute(
+        update(GmailUser)
+        .where(GmailUser.email == email)
+        .values(credentials=null(), watch_expiration=None, history_id=None, logged_out_at=datetime.utcnow())
+        .returning(GmailUser.id)
+    )
+    if res_user.scalar_one_or_none() is None:
         raise HTTPException(status_code=404, detail="User not found")
-    user.credentials = None
-    user.watch_expiration = None
-    user.history_id = None
-    user.logged_out_at = datetime.utcnow()
     await session.commit()
+    _service_cache.pop(email, None)
+    invalidate_user_caches(email)
     return {"status": "success", "message": "User logged out"}
 
 
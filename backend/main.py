@@ -1,17 +1,36 @@
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from db import engine
 from models import Base
 from routes import router as api_router
 from mail import app as mail_app
+from gemini_utils import close_client, warmup_client
 import os
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 app = FastAPI(
     title="AI Document Reconciliation API",
     description="Extracts and compares data from invoices and POs using AI.",
+    default_response_class=ORJSONResponse,
 )
 
+# --- Logging ---
+# Handlers write from a listener thread; request coroutines only enqueue records.
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+log_listener = QueueListener(log_queue, _log_handler)
+
+def setup_logging():
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+    root.handlers = [QueueHandler(log_queue)]
+    log_listener.start()
+
 # --- CORS Middleware ---
 app.add_middleware(
     CORSMiddleware,
@@ -28,8 +47,27 @@ app.include_router(mail_app.router)
 # --- Database Initialization ---
 @app.on_event("startup")
 async def on_startup():
+    setup_logging()
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all, checkfirst=True)
+    await warmup_client()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await close_client()
+    # Close the pooled Postgres connections shared by requests and background syncs
+    await engine.dispose()
+    log_listener.stop()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
+    # uvloop/httptools replace the stdlib event loop and HTTP parser; workers need the import string.
+    # Each worker runs its own startup (create_all, token refresh loop), so scale up via WEB_CONCURRENCY.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 8000)),
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", 1)),
+        access_log=os.getenv("ACCESS_LOG") == "1",
+    )
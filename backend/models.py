@@ -8,11 +8,15 @@ from sqlalchemy import (
     Text,
     ForeignKey,
     UniqueConstraint,
+    Index,
     DateTime,
-    JSON
+    JSON,
+    DDL,
+    event,
 )
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.orm import relationship
+from sqlalchemy.sql import literal_column, func
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 Base = declarative_base()
 
@@ -148,6 +152,11 @@ class GmailUser(Base):
     last_sync = Column(DateTime(timezone=True), nullable=True)
     logged_out_at = Column(DateTime, nullable=True)
     
+    # Lets the token refresher find credentials that are about to expire
+    __table_args__ = (
+        Index("ix_gmail_users_credentials_expiry", credentials[literal_column("'expiry'")].astext),
+    )
+    
     # Relationships to documents
     invoices = relationship(
         "InvoiceDB",
@@ -164,11 +173,32 @@ class GmailUser(Base):
     )
 
 
+def email_search_vector(subject, from_addr):
+    """
+    Weighted full-text vector over subject (A) and sender (B).
+    Every literal is inlined so queries built from it match the ix_gmail_emails_search expression index.
+    """
+    def weighted(column, weight):
+        return func.setweight(
+            func.to_tsvector(literal_column("'simple'"), func.coalesce(column, literal_column("''"))),
+            literal_column(f"'{weight}'"),
+        )
+    return weighted(subject, "A").op("||")(weighted(from_addr, "B"))
+
+
+def email_sort_date(internal_date):
+    """
+    internal_date with NULL read as '' (sorting last under DESC), so every row has a cursor value.
+    The literal is inlined so queries built from it match the ix_gmail_emails_user_date expression.
+    """
+    return func.coalesce(internal_date, literal_column("''"))
+
+
 class GmailEmail(Base):
     __tablename__ = "gmail_emails"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_email = Column(String, index=True, nullable=False)
+    user_email = Column(String, nullable=False)  # leading column of the composite indexes below
     message_id = Column(String, unique=True, index=True, nullable=False)
     thread_id = Column(String, nullable=True)
     from_addr = Column(String, nullable=True)
@@ -177,11 +207,12 @@ class GmailEmail(Base):
     date = Column(String, nullable=True)
     snippet = Column(Text, nullable=True)
     labels = Column(JSONB, nullable=False, default=list)
-    internal_date = Column(String, index=True, nullable=True)
+    internal_date = Column(String, nullable=True)
     received_at = Column(DateTime, default=datetime.utcnow)
 
-    body_plain = Column(Text, nullable=True)
-    body_html = Column(Text, nullable=True)
+    # Bodies are deferred: listings never load them, get_email_details undefers them
+    body_plain = deferred(Column(Text, nullable=True))
+    body_html = deferred(Column(Text, nullable=True))
     body_snippet = Column(Text, nullable=True)
 
     has_attachments = Column(Boolean, default=False)
@@ -190,30 +221,83 @@ class GmailEmail(Base):
     priority = Column(String, nullable=True)
     is_important = Column(Boolean, default=False)
     category = Column(String, nullable=True)
-    sender_domain = Column(String, index=True, nullable=True)
+    sender_domain = Column(String, nullable=True)
+
+    # Equality columns first, then the listing's sort key (email_sort_date DESC);
+    # id breaks internal_date ties for the keyset cursor in get_user_emails
+    __table_args__ = (
+        Index("ix_gmail_emails_user_date", user_email, email_sort_date(internal_date).desc(), id.desc()),
+        # Partial indexes hold only the flagged rows, so flag counts/listings walk just those entries
+        Index(
+            "ix_gmail_emails_user_important_date", user_email, internal_date.desc().nullslast(),
+            postgresql_where=is_important.is_(True),
+        ),
+        Index("ix_gmail_emails_user_attachments", user_email, postgresql_where=has_attachments.is_(True)),
+        Index("ix_gmail_emails_user_domain_date", user_email, sender_domain, internal_date.desc().nullslast()),
+        # Case-insensitive prefix search (short search_emails queries); text_pattern_ops lets LIKE 'x%' use them
+        Index(
+            "ix_gmail_emails_user_subject_lower", user_email, func.lower(subject).label("subject_lower"),
+            postgresql_ops={"subject_lower": "text_pattern_ops"},
+        ),
+        Index(
+            "ix_gmail_emails_user_from_lower", user_email, func.lower(from_addr).label("from_lower"),
+            postgresql_ops={"from_lower": "text_pattern_ops"},
+        ),
+        # Full-text search over subject and sender (search_emails)
+        Index("ix_gmail_emails_search", email_search_vector(subject, from_addr), postgresql_using="gin"),
+    )
+
+
+# Bodies are large and compress well: TOAST them with lz4 (Postgres 14+) instead of the default pglz
+event.listen(
+    GmailEmail.__table__,
+    "after_create",
+    DDL(
+        "ALTER TABLE gmail_emails "
+        "ALTER COLUMN body_plain SET COMPRESSION lz4, "
+        "ALTER COLUMN body_html SET COMPRESSION lz4"
+    ).execute_if(dialect="postgresql"),
+)
 
 
 class GmailSenderStat(Base):
     __tablename__ = "gmail_sender_stats"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_email = Column(String, index=True, nullable=False)
-    domain = Column(String, index=True, nullable=False)
+    user_email = Column(String, nullable=False)  # covered by uq_user_domain
+    domain = Column(String, nullable=False)
     email_count = Column(Integer, default=0)
     last_email_date = Column(DateTime, nullable=True)
 
     __table_args__ = (
         UniqueConstraint("user_email", "domain", name="uq_user_domain"),
+        # Top-senders lookup: reads the first rows in count order without visiting the table
+        Index(
+            "ix_gmail_sender_stats_user_count", user_email, email_count.desc(),
+            postgresql_include=["domain", "last_email_date"],
+        ),
     )
 
 
+class GmailUserStat(Base):
+    """Per-user email counters, bumped as new emails are stored (read by status/analytics)"""
+    __tablename__ = "gmail_user_stats"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, unique=True, nullable=False)
+    total_emails = Column(Integer, nullable=False, default=0)
+    important_emails = Column(Integer, nullable=False, default=0)
+    attachment_emails = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
 class OAuthState(Base):
     __tablename__ = "oauth_states"
 
     id = Column(Integer, primary_key=True, index=True)
     state = Column(String, unique=True, index=True, nullable=False)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
-    expires_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)  # range-scanned by the expired-state cleanup
 
 
 class EmailEvent(Base):
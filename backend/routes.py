@@ -6,16 +6,17 @@ from db import get_async_session
 from datetime import datetime
 from vps_utils import compute_vps_from_compare_data
 from models import InvoiceDB, PurchaseOrderDB, CompareResponseDB, GmailUser, ReportDB
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
 import datetime
 from gemini_utils import (
     call_gemini_api,
-    EXTRACTION_SCHEMA,
+    EXTRACTION_PROMPT,
+    EXTRACTION_GENERATION_CONFIGS,
     EXTRACTION_MODEL,
     COMPARISON_MODEL,
     COMPARISON_SCHEMA,
 )
-import json
+import orjson
 import base64
 import httpx
 
@@ -139,6 +140,10 @@ class ExtractRequest(BaseModel):
         None,
         description="Direct download URL of the attachment (e.g., /user/emails/{message_id}/attachments/{filename})."
     )
+    mode: Literal["core", "full"] = Field(
+        "full",
+        description="'core' extracts identifiers, total and basic line items only; 'full' extracts every field."
+    )
 
 
 class ExtractResponse(DocumentData):
@@ -199,19 +204,11 @@ async def extract_data(
         resolved_image_b64 = request.image_data
         resolved_mime = request.image_mime_type or "image/png"
 
-    extraction_prompt = (
-        "You are an expert OCR and data extraction service. "
-        "Analyze the provided document image (invoice or PO) and extract key information "
-        "according to the provided JSON schema. "
-        "If a field is not present, omit it from the JSON."
-        "Provide is_invoice as true for invoices, false for purchase orders."
-    )
-
     payload = {
         "contents": [
             {
                 "parts": [
-                    {"text": extraction_prompt},
+                    {"text": EXTRACTION_PROMPT},
                     {
                         "inlineData": {
                         "mimeType": resolved_mime,
@@ -221,10 +218,7 @@ async def extract_data(
                 ]
             }
         ],
-        "generationConfig": {
-            "responseMimeType": "application/json",
-            "responseSchema": EXTRACTION_SCHEMA,
-        },
+        "generationConfig": EXTRACTION_GENERATION_CONFIGS[request.mode],
     }
 
     try:
@@ -373,6 +367,11 @@ async def compare_data(request: CompareRequest, session: AsyncSession = Depends(
     discrepancy_vector = list(discrepancy_result["detailed_flags"].values())
     print(f"Discrepancy vector generated: {discrepancy_vector}")
 
+    # Pretty-printed once; the PO/invoice JSON goes into both the prompt and the report
+    po_json = orjson.dumps(po_data, option=orjson.OPT_INDENT_2).decode()
+    invoice_json = orjson.dumps(invoice_data, option=orjson.OPT_INDENT_2).decode()
+    discrepancy_json = orjson.dumps(discrepancy_result, option=orjson.OPT_INDENT_2).decode()
+
     # ---------------------- Step 4: Prepare Gemini reasoning prompt ----------------------
     comparison_prompt = f"""
     You are an expert financial document auditor. You are given:
@@ -399,13 +398,13 @@ async def compare_data(request: CompareRequest, session: AsyncSession = Depends(
     }}
 
     ### Purchase Order:
-    {json.dumps(po_data, indent=2)}
+    {po_json}
 
     ### Invoice:
-    {json.dumps(invoice_data, indent=2)}
+    {invoice_json}
 
     ### Discrepancy Output:
-    {json.dumps(discrepancy_result, indent=2)}
+    {discrepancy_json}
     """
 
     payload = {
@@ -441,8 +440,8 @@ async def compare_data(request: CompareRequest, session: AsyncSession = Depends(
                 "role": "server",
                 "content": (
                     f"**Summary:** {validated_report.summary}\n\n"
-                    f"**Purchase Order Data:**\n```json\n{json.dumps(po_data, indent=2)}\n```\n\n"
-                    f"**Invoice Data:**\n```json\n{json.dumps(invoice_data, indent=2)}\n```"
+                    f"**Purchase Order Data:**\n```json\n{po_json}\n```\n\n"
+                    f"**Invoice Data:**\n```json\n{invoice_json}\n```"
                 ),
             }
         ]
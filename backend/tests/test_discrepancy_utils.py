@@ -0,0 +1,27 @@
+from discrepancy_utils import check_quantity_discrepancies
+
+
+def _doc(*quantities):
+    return {"line_items": [{"quantity": q, "unit_price": 1, "total": q} for q in quantities]}
+
+
+def test_fractional_quantities_are_not_under_billing():
+    flags, _ = check_quantity_discrepancies(_doc(0.2, 0.1), _doc(0.3))
+
+    assert flags["Under-billing on quantity"] == 0
+    assert flags["Over-billing on quantity"] == 0
+
+
+def test_fractional_quantities_are_not_over_billing():
+    flags, _ = check_quantity_discrepancies(_doc(0.3), _doc(0.1, 0.1, 0.1))
+
+    assert flags["Over-billing on quantity"] == 0
+    assert flags["Under-billing on quantity"] == 0
+
+
+def test_quantity_mismatch_is_still_flagged():
+    flags, _ = check_quantity_discrepancies(_doc(2), _doc(3))
+    assert flags["Over-billing on quantity"] == 1
+
+    flags, _ = check_quantity_discrepancies(_doc(3), _doc(2))
+    assert flags["Under-billing on quantity"] == 1
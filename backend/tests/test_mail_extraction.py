@@ -0,0 +1,44 @@
+import base64
+
+import pytest
+
+pytest.importorskip("googleapiclient")
+pytest.importorskip("asyncpg")
+
+from mail import enrich_email_info, prepare_email_info
+
+
+def _message_without_subject():
+    body = base64.urlsafe_b64encode(b"Hello").decode()
+    return {
+        "id": "msg-1",
+        "threadId": "thread-1",
+        "snippet": "Hello",
+        "labelIds": ["INBOX"],
+        "internalDate": "1700000000000",
+        "payload": {
+            "mimeType": "text/plain",
+            "headers": [
+                {"name": "From", "value": "Alice <alice@example.com>"},
+                {"name": "To", "value": "bob@example.com"},
+            ],
+            "body": {"size": 5, "data": body},
+        },
+    }
+
+
+def test_prepare_email_info_without_subject_header():
+    email_info = prepare_email_info("bob@example.com", _message_without_subject())
+
+    assert email_info["subject"] is None
+    assert email_info["body_plain"] == "Hello"
+    assert email_info["sender_domain"] == "example.com"
+    assert "is_important" not in email_info
+    assert "category" not in email_info
+
+
+def test_enrich_email_info_with_none_subject():
+    email_info = enrich_email_info({"subject": None, "from": None})
+
+    assert "priority" not in email_info
+    assert "category" not in email_info